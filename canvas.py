@@ -0,0 +1,129 @@
+import os
+import time
+import random
+import argparse
+import tracemalloc
+import numpy as np
+from numpy.lib.format import open_memmap
+from object_placement import make_map, MapRaster
+from entity_store import EntityStore
+from rendering import MapRenderer
+
+#Canopy and thermal images of a map kept in memory-mapped .npy files in a
+#directory, for maps whose images do not fit in memory. The palette ids of
+#every pixel are painted to disk once, and every frame is then drawn from
+#them one band of rows at a time, so only a band is ever held in memory.
+#Colours are stored as uint8 and temperatures as float32.
+class MapCanvas:
+    def __init__(self, directory, renderer, band_rows=256):
+        self.directory = directory
+        self.renderer = renderer
+        self.raster = renderer.raster
+        self.shape = self.raster.shape
+        self.band_rows = band_rows
+        self.bands = [(r0, min(r0 + band_rows, self.shape[0])) for r0 in range(0, self.shape[0], band_rows)]
+
+        os.makedirs(directory, exist_ok=True)
+        self.ids = open_memmap(os.path.join(directory, 'ids.npy'), mode='w+', dtype=np.int32, shape=self.shape)
+        self.canopy = open_memmap(os.path.join(directory, 'canopy.npy'), mode='w+', dtype=np.uint8, shape=self.shape + (3,))
+        self.thermal = open_memmap(os.path.join(directory, 'thermal.npy'), mode='w+', dtype=np.float32, shape=self.shape)
+
+        #Entities crossing every band, in painting order
+        y0, y1, x0, x1 = self.raster.footprints.T
+        indices = np.flatnonzero((y1 > y0) & (x1 > x0))
+        first = y0[indices] // band_rows
+        spans = (y1[indices] - 1) // band_rows - first + 1
+        entities = np.repeat(indices, spans)
+        bands = np.repeat(first - np.cumsum(spans) + spans, spans) + np.arange(len(entities))
+        order = np.argsort(bands, kind='stable')
+        starts = np.searchsorted(bands[order], np.arange(len(self.bands) + 1))
+        entities = entities[order]
+
+        for band, (r0, r1) in enumerate(self.bands):
+            labels = self.raster.get_band_labels(r0, r1, entities[starts[band]:starts[band + 1]])
+            self.ids[r0:r1] = renderer.get_ids(labels, r0)
+        self.ids.flush()
+
+    def __len__(self):
+        return len(self.bands)
+
+    #Draws the canopy image of an hour of the day, with an overlay colour
+    #(rain or snow) on a random share of the pixels given by intensity
+    def render(self, hour, overlay=None, intensity=0):
+        palette = self.renderer.get_palette(hour)
+        for r0, r1 in self.bands:
+            band = palette[self.ids[r0:r1]]
+            if overlay is not None:
+                band[np.random.random(band.shape[:2]) < intensity] = overlay
+            self.canopy[r0:r1] = band
+        return self.canopy
+
+    #Paints the temperature of every entity into the thermal image and
+    #returns its mean. Fixed colour pixels show the temperature of their entity.
+    def render_thermal(self, temperatures):
+        table = np.concatenate([temperatures, temperatures[self.renderer.masked]])
+        total = 0.0
+        for r0, r1 in self.bands:
+            band = table[self.ids[r0:r1]]
+            self.thermal[r0:r1] = band
+            total += band.sum()
+        return total / self.thermal.size
+
+    def flush(self):
+        self.canopy.flush()
+        self.thermal.flush()
+
+    def __str__(self):
+        nbytes = self.ids.nbytes + self.canopy.nbytes + self.thermal.nbytes
+        return f"MapCanvas: {self.shape[0]}x{self.shape[1]} pixels in {len(self)} bands of {self.band_rows} rows, {nbytes / 2**20:.1f} MB in {self.directory}"
+
+#Renders one frame of a bulk-generated map out of core and reports the
+#time and the peak memory the canvas took, next to the size of the images
+#the in-memory renderer would hold
+def benchmark_canvas(directory, rows, cols, blocksize=25, band_rows=256, seed=0):
+    #map.py draws its frames with MapCanvas, so it is imported here
+    from map import thermal_equation_vectorized
+
+    random.seed(seed)
+    np.random.seed(seed)
+    start_time = time.perf_counter()
+    blocks, map_shape = make_map(blocksize, rows, cols, True, True, store=EntityStore(), bulk=True)
+    raster = MapRaster(blocks, map_shape, blocksize, paint=False)
+    renderer = MapRenderer(blocks, map_shape, blocksize, raster)
+    print(f"Map of {rows}x{cols} blocks, {len(raster)} entities, built in {time.perf_counter() - start_time:.2f} s")
+
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    canvas = MapCanvas(directory, renderer, band_rows)
+    ids_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    canvas.render(12)
+    render_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    temperatures = thermal_equation_vectorized(raster.get_heat_vals(), 12)
+    depicted_temp = canvas.render_thermal(temperatures)
+    thermal_time = time.perf_counter() - start_time
+    canvas.flush()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    in_memory = raster.shape[0] * raster.shape[1] * (4 + 4 + 3 + 8)
+    print(canvas)
+    print(f"Ids {ids_time:.2f} s, canopy {render_time:.2f} s, thermal {thermal_time:.2f} s, depicted temp {depicted_temp:.2f}")
+    print(f"Peak memory {peak / 2**20:.1f} MB, against {in_memory / 2**20:.1f} MB for the labels, ids and images in memory")
+    return peak, in_memory
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a large map into memory-mapped images one band of rows at a time.")
+    parser.add_argument('directory', help="Directory to keep the memory-mapped images in")
+    parser.add_argument('--rows', type=int, default=200, help="No. of block rows")
+    parser.add_argument('--cols', type=int, default=200, help="No. of block columns")
+    parser.add_argument('--blocksize', type=int, default=25, help="Size of a block in pixels")
+    parser.add_argument('--band-rows', type=int, default=256, help="Pixel rows drawn at a time")
+    args = parser.parse_args()
+    if args.rows <= 0 or args.cols <= 0 or args.band_rows <= 0:
+        parser.error("--rows, --cols and --band-rows must be positive")
+    benchmark_canvas(args.directory, args.rows, args.cols, args.blocksize, args.band_rows)
+
+if __name__ == "__main__":
+    main()
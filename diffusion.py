@@ -0,0 +1,257 @@
+from functools import lru_cache
+import numpy as np
+from object_placement import MapRaster, neighbour_table
+
+#Counts the in-bounds neighbours of every cell of a grid
+def neighbour_counts(shape):
+    counts = np.full(shape, 4.0)
+    counts[..., 0, :] -= 1
+    counts[..., -1, :] -= 1
+    counts[..., :, 0] -= 1
+    counts[..., :, -1] -= 1
+    return counts
+
+#Sums the up, down, left and right neighbours of every cell, skipping out of bounds ones
+def neighbour_sum(grid):
+    total = np.zeros(grid.shape)
+    total[..., 1:, :] += grid[..., :-1, :]
+    total[..., :-1, :] += grid[..., 1:, :]
+    total[..., :, 1:] += grid[..., :, :-1]
+    total[..., :, :-1] += grid[..., :, 1:]
+    return total
+
+#One explicit diffusion step over a whole grid using array slicing
+def diffusion_step(grid, diffusion_rate, counts=None):
+    if counts is None:
+        counts = neighbour_counts(grid.shape)
+    avg_temp = neighbour_sum(grid) / counts
+    new_grid = grid + diffusion_rate * (avg_temp - grid)
+
+    #Keeps the grid's dtype so integer heat values behave as in heat_diffusion
+    if new_grid.dtype != grid.dtype:
+        new_grid = new_grid.astype(grid.dtype)
+    return new_grid
+
+#Factorises tridiagonal systems along the last axis for the Thomas algorithm
+def tridiagonal_factors(lower, diag, upper):
+    upper_factor = np.zeros(diag.shape)
+    inverse = np.zeros(diag.shape)
+    inverse[..., 0] = 1 / diag[..., 0]
+    upper_factor[..., 0] = upper[..., 0] * inverse[..., 0]
+    for i in range(1, diag.shape[-1]):
+        inverse[..., i] = 1 / (diag[..., i] - lower[..., i] * upper_factor[..., i-1])
+        upper_factor[..., i] = upper[..., i] * inverse[..., i]
+    return lower, upper_factor, inverse
+
+#Solves every tridiagonal system along the last axis at once
+def tridiagonal_solve(factors, rhs):
+    lower, upper_factor, inverse = factors
+    solution = np.empty(rhs.shape)
+    solution[..., 0] = rhs[..., 0] * inverse[..., 0]
+    for i in range(1, rhs.shape[-1]):
+        solution[..., i] = (rhs[..., i] - lower[..., i] * solution[..., i-1]) * inverse[..., i]
+    for i in range(rhs.shape[-1] - 2, -1, -1):
+        solution[..., i] -= upper_factor[..., i] * solution[..., i+1]
+    return solution
+
+#Backward Euler system for the neighbours along the last axis of a grid
+def implicit_system(counts, timestep):
+    coupling = timestep / counts
+    lower = -coupling.copy()
+    upper = -coupling.copy()
+    lower[..., 0] = 0
+    upper[..., -1] = 0
+    diag = 1 - lower - upper
+    return tridiagonal_factors(lower, diag, upper)
+
+#Row and column factorisations for an implicit step, cached per grid shape and timestep
+@lru_cache(maxsize=8)
+def implicit_factors(shape, timestep):
+    counts = neighbour_counts(shape)
+    rows = implicit_system(counts, timestep)
+    columns = implicit_system(counts.T, timestep)
+    return rows, columns
+
+#One implicit diffusion step, solved row by row and then column by column.
+#Each half is a backward Euler step so it stays stable for any timestep.
+def implicit_step(grid, timestep):
+    rows, columns = implicit_factors(grid.shape[-2:], timestep)
+    grid = tridiagonal_solve(rows, grid)
+    grid = tridiagonal_solve(columns, np.swapaxes(grid, -1, -2))
+    return np.swapaxes(grid, -1, -2)
+
+#Diffuses a field with the selected solver. For the implicit solver the
+#diffusion rate is the timestep of each step, and can be much larger than 1.
+def diffuse_field(field, diffusion_rate=0.01, iterations=3, solver='explicit', counts=None):
+    if solver == 'explicit':
+        if counts is None:
+            counts = neighbour_counts(field.shape)
+        for _ in range(iterations):
+            field = diffusion_step(field, diffusion_rate, counts)
+    elif solver == 'implicit':
+        for _ in range(iterations):
+            field = implicit_step(field, diffusion_rate)
+    else:
+        raise ValueError(f"Unknown diffusion solver: {solver}")
+    return field
+
+#Same update as heat_diffusion in map.py, with the stencil done by NumPy slicing
+def heat_diffusion_vectorized(blocks, diffusion_rate=0.01, iterations=3):
+    counts = {}
+    for _ in range(iterations):
+        for block in blocks:
+            items = block.items
+
+            # Creates a grid to represent temperatures
+            grid_size = (block.size, block.size)
+            temperature_grid = np.full(grid_size, block.get_heat_val())
+
+            # Set initial temperatures for items
+            for item in items:
+                x, y = item.get_topleft()
+                size = item.get_size()
+                temperature_grid[y:y+size[0], x:x+size[1]] = item.get_heat_val()
+
+            # Applies diffusion
+            if grid_size not in counts:
+                counts[grid_size] = neighbour_counts(grid_size)
+            temp_grid = diffusion_step(temperature_grid, diffusion_rate, counts[grid_size])
+
+            # Update item temperatures
+            for item in items:
+                x, y = item.get_topleft()
+                size = item.get_size()
+                item.set_heat_val(np.mean(temp_grid[y:y+size[0], x:x+size[1]]))
+
+            # Update block temperature
+            block.set_heat_val(np.mean(temp_grid))
+
+    return blocks
+
+#Diffuses heat over one map-sized field so neighbouring blocks exchange heat
+def heat_diffusion_global(blocks, raster, diffusion_rate=0.01, iterations=3, solver='explicit'):
+    field = diffuse_field(raster.get_heat_vals()[raster.labels], diffusion_rate, iterations, solver)
+
+    # Update item and block temperatures from the mean over their footprints
+    raster.set_heat_vals(raster.footprint_means(field))
+    return blocks
+
+#Map-sized temperature field that is kept between simulation steps
+class ThermalField:
+    def __init__(self, blocks, map_shape, blocksize=25, raster=None):
+        self.raster = raster if raster is not None else MapRaster(blocks, map_shape, blocksize)
+        self.heat_vals = self.raster.get_heat_vals()
+        self.field = self.heat_vals[self.raster.labels]
+        self.counts = neighbour_counts(self.field.shape)
+
+        #Flat pixel indices of every entity, grouped by entity
+        labels = self.raster.labels.ravel()
+        self.pixels = np.argsort(labels, kind='stable')
+        self.pixel_bounds = np.searchsorted(labels[self.pixels], np.arange(len(self.raster) + 1))
+
+        #Block sized tiles used to skip parts of the map that are at steady state
+        self.blocksize = blocksize
+        self.tile_shape = tuple(map_shape)
+        self.active = np.ones(self.tile_shape, dtype=bool)
+        self.tile_neighbours = neighbour_table(self.tile_shape)
+        footprints = self.raster.footprints
+        self.entity_tiles = np.ravel_multi_index(
+            (np.minimum(footprints[:, 0] // blocksize, map_shape[0] - 1),
+             np.minimum(footprints[:, 2] // blocksize, map_shape[1] - 1)), self.tile_shape)
+
+        #Gather indices of every tile with a one pixel halo around it
+        halo = np.arange(-1, blocksize + 1)
+        self.tile_rows = np.arange(map_shape[0])[:, None] * blocksize + halo
+        self.tile_cols = np.arange(map_shape[1])[:, None] * blocksize + halo
+        self.row_valid = (self.tile_rows >= 0) & (self.tile_rows < self.field.shape[0])
+        self.col_valid = (self.tile_cols >= 0) & (self.tile_cols < self.field.shape[1])
+        self.tile_rows = np.clip(self.tile_rows, 0, self.field.shape[0] - 1)
+        self.tile_cols = np.clip(self.tile_cols, 0, self.field.shape[1] - 1)
+
+        #Convergence history: iterations actually performed and residuals per iteration
+        self.total_iterations = 0
+        self.residuals = []
+
+        for index, entity in enumerate(self.raster.entities):
+            entity.bind_field(self, index)
+        self.raster.thermal_field = self
+
+    def get_heat_val(self, index):
+        return self.heat_vals[index]
+
+    #Shifts the visible pixels of an entity so the field keeps its spatial detail
+    def set_heat_val(self, index, heat_val):
+        pixels = self.pixels[self.pixel_bounds[index]:self.pixel_bounds[index + 1]]
+        self.field.ravel()[pixels] += heat_val - self.heat_vals[index]
+        self.heat_vals[index] = heat_val
+        self.active.ravel()[self.entity_tiles[index]] = True
+
+    #Sets the heat values of all entities at once
+    def set_heat_vals(self, heat_vals):
+        delta = heat_vals - self.heat_vals
+        self.field += delta[self.raster.labels]
+        self.heat_vals[:] = heat_vals
+        self.active.ravel()[self.entity_tiles[delta != 0]] = True
+
+    #Explicit step of the active tiles only, returning the largest change of each tile
+    def step_tiles(self, diffusion_rate, tiles):
+        tile_r, tile_c = np.unravel_index(tiles, self.tile_shape)
+        rows = self.tile_rows[tile_r][:, :, None]
+        cols = self.tile_cols[tile_c][:, None, :]
+        valid = self.row_valid[tile_r][:, :, None] & self.col_valid[tile_c][:, None, :]
+        grids = np.where(valid, self.field[rows, cols], 0)
+
+        #Same update as diffusion_step, on the inside of every gathered tile
+        inside = grids[:, 1:-1, 1:-1]
+        total = grids[:, :-2, 1:-1] + grids[:, 2:, 1:-1] + grids[:, 1:-1, :-2] + grids[:, 1:-1, 2:]
+        counts = self.counts[rows[:, 1:-1], cols[:, :, 1:-1]]
+        new = inside + diffusion_rate * (total / counts - inside)
+        self.field[rows[:, 1:-1], cols[:, :, 1:-1]] = new
+        return np.abs(new - inside).max(axis=(1, 2))
+
+    #Largest change of every tile between two fields
+    def tile_residuals(self, old_field):
+        change = np.abs(self.field - old_field)
+        rows, cols = self.tile_shape
+        return change.reshape(rows, self.blocksize, cols, self.blocksize).max(axis=(1, 3)).ravel()
+
+    #Diffuses the field in place and refreshes the entity heat values.
+    #With a tolerance the explicit solver only steps tiles that are still
+    #changing and stops once nothing changes by more than the tolerance.
+    #Returns the number of iterations performed.
+    def step(self, diffusion_rate=0.01, iterations=3, solver='explicit', tolerance=None):
+        if tolerance is None:
+            self.field[...] = diffuse_field(self.field, diffusion_rate, iterations, solver, self.counts)
+            self.total_iterations += iterations
+            self.heat_vals[:] = self.raster.footprint_means(self.field)
+            return iterations
+
+        performed = 0
+        for _ in range(iterations):
+            tiles = np.flatnonzero(self.active)
+            if len(tiles) == 0:
+                break
+
+            residuals = np.zeros(self.active.size)
+            if solver == 'explicit' and len(tiles) < self.active.size:
+                residuals[tiles] = self.step_tiles(diffusion_rate, tiles)
+            else:
+                old_field = self.field.copy()
+                self.field[...] = diffuse_field(self.field, diffusion_rate, 1, solver, self.counts)
+                residuals = self.tile_residuals(old_field)
+            performed += 1
+            self.residuals.append((residuals.max(), residuals[tiles].mean()))
+
+            #Tiles that still change stay active and wake up the tiles next to
+            #them. A step only moves heat across edges, so diagonal tiles wait
+            #until a tile next to them changes.
+            changing = residuals >= tolerance
+            neighbours = self.tile_neighbours[changing]
+            self.active = changing.copy()
+            self.active[neighbours[neighbours >= 0]] = True
+            self.active = self.active.reshape(self.tile_shape)
+
+        self.total_iterations += performed
+        if performed:
+            self.heat_vals[:] = self.raster.footprint_means(self.field)
+        return performed
@@ -0,0 +1,351 @@
+import time
+import argparse
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from diffusion import diffuse_field
+
+#Array in a block of shared memory, created by the main process and attached to by name in the workers
+def shared_array(shape, dtype, name=None):
+    dtype = np.dtype(dtype)
+    if name is None:
+        memory = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+    else:
+        memory = shared_memory.SharedMemory(name=name)
+    return memory, np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+
+#In-bounds neighbour counts of rows r0 to r1 of a grid, the band of neighbour_counts(shape)
+def band_counts(shape, r0, r1):
+    counts = np.full((r1 - r0, shape[1]), 4.0)
+    if r0 == 0:
+        counts[0, :] -= 1
+    if r1 == shape[0]:
+        counts[-1, :] -= 1
+    counts[:, 0] -= 1
+    counts[:, -1] -= 1
+    return counts
+
+#Explicit diffusion step of rows r0 to r1, reading the rows next to the band
+#as its halo. Neighbours are added in the same order as neighbour_sum, so the
+#bands give exactly the same field as diffusion_step on the whole grid.
+def band_step(source, target, r0, r1, counts, diffusion_rate):
+    inside = source[r0:r1]
+    total = np.zeros(inside.shape)
+    total[1:, :] += inside[:-1, :]
+    if r0 > 0:
+        total[0, :] += source[r0 - 1]
+    total[:-1, :] += inside[1:, :]
+    if r1 < source.shape[0]:
+        total[-1, :] += source[r1]
+    total[:, 1:] += inside[:, :-1]
+    total[:, :-1] += inside[:, 1:]
+    target[r0:r1] = inside + diffusion_rate * (total / counts - inside)
+
+#Labels of rows r0 to r1 painted from the footprints of the entities crossing
+#them, later entities painting over earlier ones as in MapRaster
+def band_labels(footprints, indices, r0, r1, width):
+    labels = np.zeros((r1 - r0, width), dtype=np.int32)
+    for index in indices:
+        y0, y1, x0, x1 = footprints[index]
+        labels[max(y0, r0) - r0:min(y1, r1) - r0, x0:x1] = index
+    return labels
+
+#Sums of rows r0 to r1 of a field over the given footprints, clipped to the
+#band, from a summed area table of the band
+def band_sums(field, footprints, r0, r1):
+    table = np.zeros((r1 - r0 + 1, field.shape[1] + 1))
+    table[1:, 1:] = field[r0:r1].cumsum(axis=0).cumsum(axis=1)
+    y0 = np.clip(footprints[:, 0], r0, r1) - r0
+    y1 = np.clip(footprints[:, 1], r0, r1) - r0
+    x0, x1 = footprints[:, 2], footprints[:, 3]
+    return table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+
+#Indices of the footprints crossing rows r0 to r1
+def band_entities(footprints, r0, r1):
+    return np.flatnonzero((footprints[:, 0] < r1) & (footprints[:, 1] > r0))
+
+#Worker process owning rows r0 to r1 of the shared fields. Runs the commands
+#sent by its BandedField until it is told to stop, replying with the result
+#of each. A failing command aborts the barrier, so the other workers give up
+#instead of waiting for this one, and its exception is sent back.
+def band_worker(names, shape, band_index, band, barrier, connection, timeout):
+    r0, r1 = band
+    memories = []
+    fields = []
+    for name in names['fields']:
+        memory, field = shared_array(shape, np.float64, name)
+        memories.append(memory)
+        fields.append(field)
+    labels_memory, labels = shared_array(shape, np.int32, names['labels'])
+    memories.append(labels_memory)
+    counts = band_counts(shape, r0, r1)
+
+    #Entity arrays, attached once the footprints are set
+    footprints = heat_vals = sums = None
+
+    #Every band has to be written before any band reads its halo
+    def step(diffusion_rate, iterations, current):
+        for _ in range(iterations):
+            band_step(fields[current], fields[1 - current], r0, r1, counts, diffusion_rate)
+            barrier.wait(timeout)
+            current = 1 - current
+        return current
+
+    try:
+        while True:
+            command, *args = connection.recv()
+            if command == 'stop':
+                break
+            try:
+                result = None
+                if command == 'step':
+                    step(*args)
+                elif command == 'footprints':
+                    entity_names, count, spans = args
+                    footprints_memory, all_footprints = shared_array((count, 4), np.int64, entity_names['footprints'])
+                    heat_memory, heat_vals = shared_array((count,), np.float64, entity_names['heat_vals'])
+                    sums_memory, all_sums = shared_array((spans[-1][1],), np.float64, entity_names['sums'])
+                    memories += [footprints_memory, heat_memory, sums_memory]
+                    entities = band_entities(all_footprints, r0, r1)
+                    labels[r0:r1] = band_labels(all_footprints, entities, r0, r1, shape[1])
+                    footprints = all_footprints[entities]
+                    start, stop = spans[band_index]
+                    sums = all_sums[start:stop]
+                    del all_footprints, all_sums
+                elif command == 'diffuse':
+                    diffusion_rate, iterations, current = args
+                    fields[current][r0:r1] = heat_vals[labels[r0:r1]]
+                    barrier.wait(timeout)
+                    current = step(diffusion_rate, iterations, current)
+                    sums[...] = band_sums(fields[current], footprints, r0, r1)
+            except Exception as e:
+                barrier.abort()
+                connection.send(('error', e))
+                break
+            connection.send(('done', result))
+    finally:
+        del fields, labels, heat_vals, sums
+        for memory in memories:
+            memory.close()
+
+#Map-sized temperature fields and labels in shared memory, split into row
+#bands that are stepped by one worker process each. The temperature field is
+#double buffered: every iteration each worker reads its band and the rows
+#above and below it from one buffer and writes its band to the other, and
+#the workers wait on a barrier before the next iteration, so the one row
+#halos are exchanged through the shared buffer. Given the entity footprints,
+#the workers paint their own bands of the labels, and every hour paint their
+#bands of the field from the heat values and sum them over the footprints.
+#The footprints, heat values and sums are in shared memory too, so only
+#commands go through the pipes and the main process never holds the field.
+class BandedField:
+    def __init__(self, shape, workers=None, timeout=60):
+        self.shape = tuple(shape)
+        self.timeout = timeout
+        workers = min(workers or multiprocessing.cpu_count(), self.shape[0])
+        self.bands = [(self.shape[0] * i // workers, self.shape[0] * (i + 1) // workers) for i in range(workers)]
+        self.current = 0
+        self.footprints = None
+        self.workers = []
+        self.connections = []
+
+        self.memories = []
+        self.fields = []
+        try:
+            for _ in range(2):
+                memory, field = shared_array(self.shape, np.float64)
+                self.memories.append(memory)
+                self.fields.append(field)
+            labels_memory, self.labels = shared_array(self.shape, np.int32)
+            self.memories.append(labels_memory)
+            names = {'fields': [memory.name for memory in self.memories[:2]], 'labels': labels_memory.name}
+
+            barrier = multiprocessing.Barrier(workers)
+            for band_index, band in enumerate(self.bands):
+                connection, worker_connection = multiprocessing.Pipe()
+                worker = multiprocessing.Process(target=band_worker, args=(names, self.shape, band_index, band, barrier, worker_connection, timeout), daemon=True)
+                worker.start()
+                worker_connection.close()
+                self.connections.append(connection)
+                self.workers.append(worker)
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.workers)
+
+    #The current temperature field
+    @property
+    def field(self):
+        return self.fields[self.current]
+
+    @field.setter
+    def field(self, field):
+        self.fields[self.current][...] = field
+
+    def set_labels(self, labels):
+        self.labels[...] = labels
+
+    #Has the workers paint the labels of their bands from the footprints of
+    #the entities in painting order, and sum their bands over them. The
+    #footprints, the heat values and the sums of every band are put in shared memory.
+    def set_footprints(self, footprints):
+        if self.footprints is not None:
+            raise ValueError("The footprints of a BandedField can only be set once")
+        footprints = np.asarray(footprints, dtype=np.int64).reshape(-1, 4)
+        self.entities = [band_entities(footprints, r0, r1) for r0, r1 in self.bands]
+        stops = np.cumsum([len(entities) for entities in self.entities]).tolist()
+        self.spans = list(zip([0] + stops[:-1], stops))
+
+        footprints_memory, self.footprints = shared_array(footprints.shape, np.int64)
+        heat_memory, self.heat_vals = shared_array((len(footprints),), np.float64)
+        sums_memory, self.sums = shared_array((stops[-1],), np.float64)
+        self.memories += [footprints_memory, heat_memory, sums_memory]
+        self.footprints[...] = footprints
+        names = {'footprints': footprints_memory.name, 'heat_vals': heat_memory.name, 'sums': sums_memory.name}
+        self.run('footprints', names, len(footprints), self.spans)
+
+    #Sends a command to every worker and returns their results. If any of
+    #them fails, its exception is raised once every worker has replied or exited.
+    def run(self, *command):
+        #A worker that has exited is reported when its reply is read
+        for connection in self.connections:
+            try:
+                connection.send(command)
+            except OSError:
+                pass
+        errors = []
+        results = []
+        for connection, worker in zip(self.connections, self.workers):
+            try:
+                status, result = connection.recv()
+            except EOFError:
+                errors.append(RuntimeError(f"Band worker {worker.pid} exited with code {worker.exitcode}"))
+                continue
+            if status == 'error':
+                errors.append(result)
+            results.append(result)
+        if errors:
+            #The workers that only saw the broken barrier did not cause the failure
+            errors.sort(key=lambda error: isinstance(error, threading.BrokenBarrierError))
+            raise errors[0]
+        return results
+
+    #Same update as diffuse_field with the explicit solver
+    def step(self, diffusion_rate=0.01, iterations=3):
+        self.run('step', diffusion_rate, iterations, self.current)
+        self.current = (self.current + iterations) % 2
+        return self.field
+
+    #Paints the heat values of the entities into the field, steps it and
+    #returns the mean of the field over every footprint, as footprint_means
+    def diffuse(self, heat_vals, diffusion_rate=0.01, iterations=3):
+        self.heat_vals[...] = heat_vals
+        self.run('diffuse', diffusion_rate, iterations, self.current)
+        self.current = (self.current + iterations) % 2
+        totals = np.zeros(len(self.footprints))
+        for entities, (start, stop) in zip(self.entities, self.spans):
+            totals[entities] += self.sums[start:stop]
+        y0, y1, x0, x1 = self.footprints.T
+        return totals / np.maximum((y1 - y0) * (x1 - x0), 1)
+
+    #Stops the workers, terminating any that do not stop in time, and always
+    #frees the shared memory
+    def close(self):
+        try:
+            for connection, worker in zip(self.connections, self.workers):
+                if worker.is_alive():
+                    try:
+                        connection.send(('stop',))
+                    except OSError:
+                        pass
+            for worker in self.workers:
+                worker.join(self.timeout)
+                if worker.is_alive():
+                    worker.terminate()
+                    worker.join()
+        finally:
+            for connection in self.connections:
+                connection.close()
+            self.workers = []
+            self.connections = []
+            self.fields = []
+            self.labels = self.footprints = self.heat_vals = self.sums = None
+            memories, self.memories = self.memories, []
+            for memory in memories:
+                try:
+                    memory.close()
+                finally:
+                    memory.unlink()
+
+#Diffuses heat over the map in the shared field of a BandedField, the same
+#update as heat_diffusion_global with the explicit solver. The footprints
+#are sent to the workers on the first call.
+def heat_diffusion_banded(blocks, raster, banded_field, diffusion_rate=0.01, iterations=3):
+    if banded_field.footprints is None:
+        banded_field.set_footprints(raster.footprints)
+    raster.set_heat_vals(banded_field.diffuse(raster.get_heat_vals(), diffusion_rate, iterations))
+    return blocks
+
+#Times the diffusion of a map of rows x cols blocks with 1 to max_workers
+#workers, against diffuse_field in this process. A step only steps the
+#field; a diffusion also paints it from the heat values of the blocks and
+#averages it over every block, as heat_diffusion_banded does every hour.
+def benchmark_scaling(rows, cols, blocksize=25, max_workers=None, iterations=3, repeats=3, seed=0):
+    shape = (rows * blocksize, cols * blocksize)
+    rng = np.random.default_rng(seed)
+    labels = np.arange(rows * cols, dtype=np.int32).reshape(rows, cols).repeat(blocksize, axis=0).repeat(blocksize, axis=1)
+    heat_vals = rng.uniform(0, 100, rows * cols)
+    field = heat_vals[labels]
+    y, x = np.divmod(np.arange(rows * cols), cols)
+    footprints = np.stack([y, y + 1, x, x + 1], axis=1) * blocksize
+
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        expected = diffuse_field(field, 0.01, iterations)
+    serial = (time.perf_counter() - start_time) / repeats
+    expected_means = expected.reshape(rows, blocksize, cols, blocksize).mean(axis=(1, 3)).ravel()
+    print(f"Map of {rows}x{cols} blocks, {shape[0]}x{shape[1]} pixels, {iterations} iterations per step, {multiprocessing.cpu_count()} CPUs")
+    print(f"{'Workers':<10}{'Step (s)':<12}{'Diffuse (s)':<14}{'Speedup':<10}{'Exact':<8}{'Max error':<12}")
+    print("-" * 66)
+    print(f"{'serial':<10}{serial:<12.4f}{'-':<14}{1:<10.2f}{'-':<8}{'-':<12}")
+
+    results = {}
+    for workers in range(1, (max_workers or multiprocessing.cpu_count()) + 1):
+        with BandedField(shape, workers) as banded_field:
+            banded_field.set_footprints(footprints)
+            step_time = diffuse_time = 0
+            for _ in range(repeats):
+                banded_field.field = field
+                start_time = time.perf_counter()
+                result = banded_field.step(0.01, iterations)
+                step_time += time.perf_counter() - start_time
+                exact = np.array_equal(result, expected)
+                del result
+                start_time = time.perf_counter()
+                means = banded_field.diffuse(heat_vals, 0.01, iterations)
+                diffuse_time += time.perf_counter() - start_time
+        error = np.abs(means - expected_means).max()
+        results[workers] = (step_time / repeats, diffuse_time / repeats)
+        print(f"{workers:<10}{step_time / repeats:<12.4f}{diffuse_time / repeats:<14.4f}{serial * repeats / step_time:<10.2f}{str(exact):<8}{error:<12.2e}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the shared-memory diffusion of a large map on 1 to N workers.")
+    parser.add_argument('--rows', type=int, default=100, help="No. of block rows")
+    parser.add_argument('--cols', type=int, default=100, help="No. of block columns")
+    parser.add_argument('--workers', type=int, help="Largest no. of workers (default: one per CPU)")
+    parser.add_argument('--iterations', type=int, default=3, help="Diffusion steps per timestep")
+    args = parser.parse_args()
+    benchmark_scaling(args.rows, args.cols, max_workers=args.workers, iterations=args.iterations)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import time
+import random
+import argparse
+import numpy as np
+from object_placement import make_map, MapRaster
+from objects import BLOCK_TYPES, ITEM_TYPES
+from diffusion import diffuse_field
+from temperature_stats import TemperatureStats
+from map import thermal_equation_vectorized, WeatherSchedule, get_scenario_config
+
+#N realisations of maps of the same shape, stacked so that they are stepped
+#together. Entities of all realisations are numbered one after another, and
+#labels has a leading realisation axis with the labels of every realisation
+#offset by the entities before it.
+class Ensemble:
+    def __init__(self, maps, map_shape, blocksize=25):
+        self.map_shape = map_shape
+        self.blocksize = blocksize
+        self.rasters = [MapRaster(blocks, map_shape, blocksize) for blocks in maps]
+        self.types = BLOCK_TYPES + ITEM_TYPES
+        sizes = np.array([len(raster) for raster in self.rasters], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)])
+        self.realisations = np.repeat(np.arange(len(self.rasters)), sizes)
+
+        #Type codes in the order of self.types, whatever order each registry found them in
+        codes = []
+        for raster in self.rasters:
+            for entity_type in raster.registry.types:
+                if entity_type not in self.types:
+                    self.types.append(entity_type)
+            lookup = np.array([self.types.index(entity_type) for entity_type in raster.registry.types], dtype=np.int16)
+            codes.append(lookup[raster.registry.type_codes])
+        self.type_codes = np.concatenate(codes)
+        self.indoor = np.isin(self.type_codes, [self.types.index('House'), self.types.index('Apartment')])
+
+        self.labels = np.stack([raster.labels + offset for raster, offset in zip(self.rasters, self.offsets)])
+        self.footprints = np.concatenate([raster.footprints for raster in self.rasters])
+        self.heat_vals = np.concatenate([raster.get_heat_vals() for raster in self.rasters])
+
+        #Pixels each entity shows in the thermal map, to average it without painting it
+        self.visible = np.bincount(self.labels.ravel(), minlength=len(self.heat_vals))
+
+    def __len__(self):
+        return len(self.rasters)
+
+    #Mean of a stacked field over every entity footprint, using one summed area table per realisation
+    def footprint_means(self, field):
+        table = np.zeros((field.shape[0], field.shape[1] + 1, field.shape[2] + 1))
+        table[:, 1:, 1:] = field.cumsum(axis=1).cumsum(axis=2)
+        y0, y1, x0, x1 = self.footprints.T
+        r = self.realisations
+        totals = table[r, y1, x1] - table[r, y0, x1] - table[r, y1, x0] + table[r, y0, x0]
+        areas = np.maximum((y1 - y0) * (x1 - x0), 1)
+        return totals / areas
+
+    #Same update as heat_diffusion_global, for all realisations at once
+    def diffuse(self, diffusion_rate=0.01, iterations=3, solver='explicit'):
+        field = diffuse_field(self.heat_vals[self.labels], diffusion_rate, iterations, solver)
+        self.heat_vals = self.footprint_means(field)
+
+    #Same update as simulate_snow, for all realisations at once
+    def simulate_snow(self, temperature_drop=30):
+        outdoor_temps = np.maximum(self.heat_vals - temperature_drop, -5)
+        indoor_temps = np.minimum(self.heat_vals + 15, 25)  # Max indoor temp of 25°C
+        self.heat_vals = np.where(self.indoor, indoor_temps, outdoor_temps)
+
+    #Mean of the thermal map of every realisation
+    def thermal_means(self, temperatures):
+        totals = np.bincount(self.realisations, weights=temperatures * self.visible, minlength=len(self))
+        return totals / self.labels[0].size
+
+    #Thermal maps of all realisations, stacked
+    def thermal_maps(self, temperatures):
+        return temperatures[self.labels]
+
+    #Writes the heat values back to the blocks and items of every realisation
+    def write_back(self):
+        for raster, start, stop in zip(self.rasters, self.offsets[:-1], self.offsets[1:]):
+            raster.set_heat_vals(self.heat_vals[start:stop])
+
+#Builds size random maps with the same configuration, seeding each from seed
+def make_ensemble(size, blocksize, rows, cols, add_forests, add_parks, seed=None):
+    seeds = np.random.SeedSequence(seed).generate_state(size)
+    maps = []
+    for realisation_seed in seeds:
+        random.seed(int(realisation_seed))
+        np.random.seed(int(realisation_seed))
+        blocks, map_shape = make_map(blocksize, rows, cols, add_forests, add_parks)
+        maps.append(blocks)
+    return Ensemble(maps, map_shape, blocksize)
+
+#Simulates every realisation of an ensemble with the physics of
+#run_simulation and the global diffusion engine. Returns the real
+#temperatures, the (hours, realisations) depicted temperatures and the
+#statistics of every realisation.
+def run_ensemble(ensemble, num_days, flood, stop_rain, snow, solver='explicit', diffusion_rate=0.01, iterations=3):
+    total_hours = num_days * 24
+    schedule = WeatherSchedule(total_hours, flood, stop_rain, snow)
+    stats = TemperatureStats(total_hours, ensemble.types, len(ensemble))
+    real_temperatures = []
+    depicted_temperatures = np.zeros((total_hours, len(ensemble)))
+
+    start_time = time.perf_counter()
+    for hour in range(total_hours):
+        hour_of_day = hour % 24
+        ensemble.diffuse(diffusion_rate, iterations, solver)
+        flood_progress, snow_progress = schedule.get_progress(hour)
+        if snow:
+            ensemble.simulate_snow(5 * snow_progress)
+
+        #Temperatures of the entities of all realisations
+        temperatures = thermal_equation_vectorized(ensemble.heat_vals, hour_of_day, flood_progress, snow_progress)
+        stats.add(hour, temperatures, ensemble.type_codes, ensemble.realisations)
+        depicted_temperatures[hour] = ensemble.thermal_means(temperatures)
+
+        #Calculating the real temperature based on the time of the day
+        real_temp = 30 + 10 * np.sin((2 * np.pi / 24) * (hour_of_day - 6))
+        if snow:
+            real_temp -= 50 * snow_progress
+            ensemble.simulate_snow(30 * snow_progress)
+        elif flood:
+            real_temp -= 10 * flood_progress
+        real_temperatures.append(real_temp)
+
+    elapsed = time.perf_counter() - start_time
+    steps = total_hours * len(ensemble)
+    print(f"Simulated {len(ensemble)} realisations of {total_hours} steps in {elapsed:.2f} s ({steps / elapsed:.2f} realisation steps per second)")
+    return real_temperatures, depicted_temperatures, stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate an ensemble of random maps together.")
+    parser.add_argument('scenario', nargs='?', choices=['snow', 'rain', 'normal'], default='normal', help="Scenario of every realisation")
+    parser.add_argument('--size', type=int, default=16, help="No. of realisations")
+    parser.add_argument('--rows', type=int, help="No. of block rows")
+    parser.add_argument('--cols', type=int, help="No. of block columns")
+    parser.add_argument('--days', type=int, help="No. of days to simulate")
+    parser.add_argument('--solver', choices=['explicit', 'implicit'], default='explicit', help="Diffusion solver")
+    parser.add_argument('--seed', type=int, help="Seed the seed of every realisation is derived from")
+    parser.add_argument('--output', help="File to save the ensemble statistics to")
+    args = parser.parse_args()
+
+    config = get_scenario_config(args.scenario)
+    config.update({key: value for key, value in [('rows', args.rows), ('cols', args.cols), ('num_days', args.days)] if value is not None})
+    if args.size <= 0 or config['rows'] <= 0 or config['cols'] <= 0 or config['num_days'] <= 0:
+        parser.error("--size, --rows, --cols and --days must be positive")
+
+    ensemble = make_ensemble(args.size, config['blocksize'], config['rows'], config['cols'], config['add_forests'], config['add_parks'], args.seed)
+    real_temperatures, depicted_temperatures, stats = run_ensemble(
+        ensemble, config['num_days'], config['flood'], config['stop_rain'], config['snow'], args.solver)
+
+    #Spread of the depicted temperature over the realisations
+    print(f"{'Hour':<10}{'Real Temp (°C)':<20}{'Depicted Mean (°C)':<22}{'Depicted Std (°C)':<20}")
+    print("-" * 72)
+    for hour, real_temp in enumerate(real_temperatures):
+        print(f"{hour:<10}{real_temp:<20.2f}{depicted_temperatures[hour].mean():<22.2f}{depicted_temperatures[hour].std():<20.2f}")
+
+    if args.output:
+        np.savez(args.output, real_temperatures=np.array(real_temperatures), depicted_temperatures=depicted_temperatures, history=stats.to_array())
+        print(f"Ensemble results saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
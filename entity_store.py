@@ -0,0 +1,225 @@
+import argparse
+import tracemalloc
+import numpy as np
+from objects import *
+
+#Columns of an EntityStore and their types. Blocks keep their top left
+#corner in pos and an (n, n) size, and only households have a boundary.
+COLUMNS = {
+    'pos': (np.int32, 2),
+    'size': (np.int32, 2),
+    'colour_index': (np.int32, None),
+    'heat': (np.float64, None),
+    'type_code': (np.int16, None),
+    'parent': (np.int32, None),
+    'boundary': (np.int16, None),
+}
+
+#Classes of the entities an EntityStore can make views of
+ENTITY_CLASSES = {cls.__name__: cls for cls in [Ground, Water, Forest, Road, Park, Tree, House, Bushes, Street, MerryGo, Slide, Pond, White_lines, Apartment]}
+
+#Columnar storage for all the blocks and items of a map. Objects and Blocks
+#size, colour, heat value and household boundary from the columns.
+#size, colour and heat value from the columns.
+class EntityStore:
+    def __init__(self, capacity=1024):
+        self.count = 0
+        self.capacity = capacity
+        for name, (dtype, width) in COLUMNS.items():
+            shape = (capacity, width) if width else (capacity,)
+            setattr(self, name, np.zeros(shape, dtype=dtype))
+
+        #Colours are stored once in a palette and referenced by index
+        self.palette = np.zeros((0, 3), dtype=np.int64)
+        self.palette_index = {}
+
+        #Type codes follow the order of the EntityRegistry
+        self.types = BLOCK_TYPES + ITEM_TYPES
+        self.type_codes = {entity_type: code for code, entity_type in enumerate(self.types)}
+
+    def __len__(self):
+        return self.count
+
+    #Doubles the columns until they can hold the given number of entities
+    def reserve(self, count):
+        if count <= self.capacity:
+            return
+        while self.capacity < count:
+            self.capacity *= 2
+        for name in COLUMNS:
+            column = getattr(self, name)
+            grown = np.zeros((self.capacity,) + column.shape[1:], dtype=column.dtype)
+            grown[:self.count] = column[:self.count]
+            setattr(self, name, grown)
+
+    #Palette index of a colour, adding it to the palette the first time
+    def get_colour_index(self, colour):
+        key = tuple(int(c) for c in np.asarray(colour).ravel()[:3])
+        if key not in self.palette_index:
+            self.palette_index[key] = len(self.palette)
+            self.palette = np.vstack([self.palette, np.array(key, dtype=np.int64)])
+        return self.palette_index[key]
+
+    #Palette indices of an array of RGB colours, adding new ones to the palette
+    def get_colour_indices(self, colours):
+        colours = np.asarray(colours, dtype=np.int64).reshape(-1, 3)
+        keys, first, inverse = np.unique((colours[:, 0] << 16) | (colours[:, 1] << 8) | colours[:, 2], return_index=True, return_inverse=True)
+        indices = np.array([self.get_colour_index(colours[index]) for index in first], dtype=np.int32)
+        return indices[inverse.ravel()]
+
+    def get_type_code(self, entity_type):
+        if entity_type not in self.type_codes:
+            self.type_codes[entity_type] = len(self.types)
+            self.types.append(entity_type)
+        return self.type_codes[entity_type]
+
+    #Adds one entity and returns its index
+    def add(self, entity_type, pos, size, colour, heat_val, parent=-1, boundary=0):
+        self.reserve(self.count + 1)
+        index = self.count
+        self.pos[index] = pos
+        self.size[index] = size
+        self.colour_index[index] = self.get_colour_index(colour)
+        self.heat[index] = heat_val
+        self.type_code[index] = self.get_type_code(entity_type)
+        self.parent[index] = parent
+        self.boundary[index] = boundary
+        self.count += 1
+        return index
+
+    #Adds many entities at once from arrays and returns their indices
+    def extend(self, type_codes, pos, size, colours, heat_vals, parents, boundaries=0):
+        count = len(type_codes)
+        self.reserve(self.count + count)
+        rows = slice(self.count, self.count + count)
+        self.pos[rows] = pos
+        self.size[rows] = size
+        self.colour_index[rows] = self.get_colour_indices(colours)
+        self.heat[rows] = heat_vals
+        self.type_code[rows] = type_codes
+        self.parent[rows] = parents
+        self.boundary[rows] = boundaries
+        self.count += count
+        return np.arange(rows.start, rows.stop)
+
+    #Values read and written by the StoreAttributes of Object and Blocks
+    def get(self, column, index):
+        if column == 'colour':
+            return self.palette[self.colour_index[index]].copy()
+        return getattr(self, column)[index]
+
+    def set(self, column, index, value):
+        if column == 'colour':
+            self.colour_index[index] = self.get_colour_index(value)
+        else:
+            getattr(self, column)[index] = value
+
+    #Moves an object or block into the store, leaving it as a view of its row
+    def adopt(self, entity, parent=-1):
+        attributes = {}
+        for cls in type(entity).__mro__:
+            for name, attribute in vars(cls).items():
+                if isinstance(attribute, StoreAttribute) and name not in attributes:
+                    attributes[name] = attribute
+        values = {attribute.column: getattr(entity, name) for name, attribute in attributes.items()}
+
+        index = self.add(entity.get_type(), values['pos'], values['size'], values['colour'], values['heat'], parent, values.get('boundary', 0))
+        for name in attributes:
+            entity.__dict__.pop(name, None)
+        entity.store = self
+        entity.index = index
+        return index
+
+    #Adopts every block of a map and its items, in the order they are painted
+    def adopt_map(self, blocks):
+        self.reserve(self.count + sum(1 + len(block.items) for block in blocks))
+        for block in blocks:
+            if block.store is None:
+                self.adopt(block)
+            for item in block.items:
+                if item.store is None:
+                    self.adopt(item, block.index)
+        return blocks
+
+    #Blocks, with their items, that are views of the entities from start on.
+    #Views are made without running the constructors, so they only hold
+    #their store and index besides their tint and image.
+    def get_blocks(self, start=0):
+        templates = {}
+        blocks = {}
+        for index, code, parent in zip(range(start, self.count), self.type_code[start:self.count].tolist(), self.parent[start:self.count].tolist()):
+            if code not in templates:
+                cls = ENTITY_CLASSES[self.types[code]]
+                template = {'store': self, 'tint': None, 'thermal_field': None, 'field_index': None}
+                if not issubclass(cls, Blocks):
+                    template['_image'] = None
+                templates[code] = (cls, template)
+            cls, template = templates[code]
+            entity = cls.__new__(cls)
+            entity.__dict__.update(template)
+            entity.index = index
+            if parent < 0:
+                entity.items = []
+                blocks[index] = entity
+            else:
+                blocks[parent].items.append(entity)
+        return list(blocks.values())
+
+    #Saves the filled part of the columns, the palette and the types to an npz
+    #file, with any extra arrays given
+    def save(self, filename, **arrays):
+        columns = {name: getattr(self, name)[:self.count] for name in COLUMNS}
+        np.savez(filename, palette=self.palette, types=np.array(self.types), **columns, **arrays)
+
+    #Store with the entities of a file written by save, and the file's other arrays
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            arrays = {name: data[name] for name in data.files}
+        store = cls(max(len(arrays['type_code']), 1))
+        store.count = len(arrays['type_code'])
+        for name in COLUMNS:
+            getattr(store, name)[:store.count] = arrays.pop(name)
+        store.palette = arrays.pop('palette').astype(np.int64).reshape(-1, 3)
+        store.palette_index = {tuple(colour): index for index, colour in enumerate(store.palette.tolist())}
+        store.types = arrays.pop('types').tolist()
+        store.type_codes = {entity_type: code for code, entity_type in enumerate(store.types)}
+        return store, arrays
+
+    #Bytes used by the filled part of the columns and the palette
+    def nbytes(self):
+        columns = sum(getattr(self, name)[:self.count].nbytes for name in COLUMNS)
+        return columns + self.palette.nbytes
+
+    def __str__(self):
+        return f"EntityStore: {self.count} entities, {len(self.palette)} colours, {self.nbytes()} bytes"
+
+#Measures the memory held by a map built with and without an EntityStore
+def benchmark_memory(rows, cols, blocksize=25, add_forests=True, add_parks=True):
+    from object_placement import make_map
+
+    results = {}
+    for use_store in [False, True]:
+        tracemalloc.start()
+        blocks, map_shape = make_map(blocksize, rows, cols, add_forests, add_parks, store=EntityStore() if use_store else None)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        entities = sum(1 + len(block.items) for block in blocks)
+        results['store' if use_store else 'objects'] = (entities, current, peak)
+        del blocks
+
+    print(f"{'Layout':<10}{'Entities':<12}{'Memory (MB)':<15}{'Peak (MB)':<15}{'Bytes/entity':<15}")
+    print("-" * 67)
+    for layout, (entities, current, peak) in results.items():
+        print(f"{layout:<10}{entities:<12}{current / 2**20:<15.2f}{peak / 2**20:<15.2f}{current / entities:<15.1f}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the memory use of maps built with and without an entity store.")
+    parser.add_argument('--rows', type=int, default=50, help="No. of block rows")
+    parser.add_argument('--cols', type=int, default=50, help="No. of block columns")
+    args = parser.parse_args()
+    benchmark_memory(args.rows, args.cols)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import os
+import json
+import queue
+import threading
+import numpy as np
+
+#Anchor points of matplotlib's jet colormap for red, green and blue
+JET_ANCHORS = [
+    ([0, 0.35, 0.66, 0.89, 1], [0, 0, 1, 1, 0.5]),
+    ([0, 0.125, 0.375, 0.64, 0.91, 1], [0, 0, 1, 1, 0, 0]),
+    ([0, 0.11, 0.34, 0.65, 1], [0.5, 1, 1, 0, 0]),
+]
+
+#256 entry jet lookup table, the same colours imshow uses with cmap="jet"
+def make_jet_lut():
+    positions = np.linspace(0, 1, 256)
+    lut = np.stack([np.interp(positions, xp, fp) for xp, fp in JET_ANCHORS], axis=1)
+    return (lut * 255).astype(np.uint8)
+
+JET_LUT = make_jet_lut()
+
+#Colours a thermal map with the jet lookup table, scaled like imshow with vmin and vmax
+def thermal_to_rgb(thermal_map, vmin=0, vmax=100):
+    scaled = (np.asarray(thermal_map, dtype=float) - vmin) * (256 / (vmax - vmin))
+    return JET_LUT[np.clip(scaled, 0, 255).astype(np.uint8)]
+
+#Writes a uint8 RGB image as a binary PPM file
+def write_ppm(filename, image):
+    with open(filename, 'wb') as ppmfile:
+        ppmfile.write(f"P6\n{image.shape[1]} {image.shape[0]}\n255\n".encode())
+        ppmfile.write(np.ascontiguousarray(image).tobytes())
+
+#Streams the canopy and thermal frames of every hour to disk from a writer
+#thread. Frames are queued in a bounded queue, so a slow disk holds the
+#simulation back instead of piling frames up in memory.
+#Formats: 'ppm' writes an image sequence, 'raw' appends rgb24 frames to
+#one file per map with a json file describing them, e.g. for
+#ffmpeg -f rawvideo -pix_fmt rgb24 -s WxH -r 10 -i canopy.rgb canopy.mp4
+class FrameSink:
+    def __init__(self, output_dir, frame_format='ppm', queue_size=8, vmin=0, vmax=100):
+        if frame_format not in ['ppm', 'raw']:
+            raise ValueError(f"Unknown frame format: {frame_format}")
+        self.output_dir = output_dir
+        self.frame_format = frame_format
+        self.vmin = vmin
+        self.vmax = vmax
+        self.frames = 0
+        self.error = None
+        self.raw_files = {}
+        self.shapes = {}
+        os.makedirs(output_dir, exist_ok=True)
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    #Queues one hour's maps as they are, they are converted to uint8 on the
+    #writer thread. The maps must not be changed afterwards; cached canopy
+    #frames are never changed and the thermal map is new every hour.
+    def write(self, hour, canopy_map, thermal_map):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((hour, canopy_map, thermal_map))
+        self.frames += 1
+
+    #Writer thread, runs until close() queues None
+    def run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                self.write_frame(*frame)
+            except Exception as e:
+                self.error = e
+
+    def write_frame(self, hour, canopy_map, thermal_map):
+        canopy = np.asarray(canopy_map).astype(np.uint8)
+        thermal = thermal_to_rgb(thermal_map, self.vmin, self.vmax)
+        for name, image in [('canopy', canopy), ('thermal', thermal)]:
+            if self.frame_format == 'ppm':
+                write_ppm(os.path.join(self.output_dir, f"{name}_{hour:05d}.ppm"), image)
+            else:
+                if name not in self.raw_files:
+                    self.raw_files[name] = open(os.path.join(self.output_dir, f"{name}.rgb"), 'wb')
+                    self.shapes[name] = image.shape
+                self.raw_files[name].write(np.ascontiguousarray(image).tobytes())
+
+    #Waits for every queued frame to be written
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        for name, rawfile in self.raw_files.items():
+            rawfile.close()
+            height, width = self.shapes[name][:2]
+            with open(os.path.join(self.output_dir, f"{name}.json"), 'w') as jsonfile:
+                json.dump({'file': f"{name}.rgb", 'pix_fmt': 'rgb24', 'width': width, 'height': height, 'frames': self.frames}, jsonfile)
+        self.raw_files = {}
+        if self.error is not None:
+            raise self.error
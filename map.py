@@ -1,70 +1,21 @@
 import random
 import numpy as np
-import matplotlib.pyplot as plt
+import time
+import os
+import sys
+import json
 from math import pi, sin
 from object_placement import *
+from diffusion import heat_diffusion_vectorized, heat_diffusion_global, ThermalField
+from rendering import MapRenderer, FrameCache, WEATHER_RULES, snow_colour, rain_colour
+from temperature_stats import TemperatureStats
+from entity_store import EntityStore
+from frame_sink import FrameSink
+from pipeline import Pipeline
+from domain import BandedField, heat_diffusion_banded
+from canvas import MapCanvas
 import argparse 
 
-#Genertes the image of the map
-def generate_image(blocks, blocksize, map_shape, hour, flood_progress, snow_progress):
-    
-    #Calculate time factor based on hour of the day for day and night simulation
-    time_factor = 0.1 - 0.9 * sin((2 * pi / 24) * (hour - 6))
-    
-    grid = np.zeros((map_shape[0]*blocksize, map_shape[1]*blocksize, 3))
-    
-    #Defining colours for flood and snow
-    flood_colour = np.array([0,119,190])
-    snow_colour = np.array([255,255,255])
-
-    for block in blocks:
-        #Adjusting block brighness based on the time of the day
-        block.day_night(time_factor)
-        cx_start, ry_start = block.get_topleft()
-        block_image = block.generate_image()
-        
-        #Handles flooding
-        if flood_progress > 0:
-            
-            #Flooding blocks
-            if block.get_type() in ['Ground', 'Water', 'Forest', 'Park'] and flood_progress > 0.2:
-                block.set_bg_colour(flood_colour)  
-            elif block.get_type() in 'Road' and flood_progress > 0.4:
-                block.set_bg_colour(flood_colour)
-
-            #Flooding items
-            for item in block.items:
-                item_type = item.get_type()
-                if item_type in ['Pond'] and flood_progress > 0.2:
-                    item.set_colour(flood_colour)
-                elif item_type in ['Street', 'White_lines'] and flood_progress > 0.5:
-                    item.set_colour(flood_colour)
-                elif item_type in ['MerryGo'] and flood_progress > 0.6:
-                    item.set_colour(flood_colour)
-                elif item_type == 'Bushes' and flood_progress > 0.8:
-                    item.set_colour(flood_colour)
-                
-        #Handles snowing
-        if snow_progress > 0:
-            # Snow covers blocks
-            if block.get_type() in ['Ground', 'Forest', 'Park'] and snow_progress > 0.2:
-                block.set_bg_colour(snow_colour)  
-            elif block.get_type() == 'Road' and snow_progress > 0.4:
-                block.set_bg_colour(snow_colour)
-
-            #snow covers items
-            for item in block.items:
-                item_type = item.get_type()
-                if item_type in ['Street', 'White_lines'] and snow_progress > 0.5:
-                    item.set_colour(snow_colour)
-                elif item_type in ['MerryGo'] and snow_progress > 0.6:
-                    item.set_colour(snow_colour)
-                elif item_type == 'Bushes' and snow_progress > 0.8:
-                    item.set_colour(snow_colour)
-
-        grid[ry_start:ry_start+blocksize, cx_start:cx_start+blocksize] = block_image
-    return grid
-
 #To simulates heat diffusion over time
 def heat_diffusion(blocks, diffusion_rate=0.01, iterations=3):
     for _ in range(iterations):
@@ -106,39 +57,60 @@ def heat_diffusion(blocks, diffusion_rate=0.01, iterations=3):
     
     return blocks
 
-#Equation to calculate block and item heat changing over time
-def thermal_equation(heat_val, hour, flood_level=0, snow_level=0):
-    heat = heat_val + 15 * np.sin((2 * np.pi / 24) * (hour - 7))  
-    cooldown = 10 * np.sin((2 * np.pi / 24) * (hour - 19))  
-    temperature = heat - cooldown
-    
-    #Applying a cooling affect for flooding
-    flood_cooling = 20 * flood_level  
-    return max(0, temperature - flood_cooling)  
-
-#Generates the thermal image of the map.
-def generate_thermal_image(blocks, blocksize, map_shape, hour, flood_level=0, snow_level = 0):
-
-    thermal_grid = np.zeros((map_shape[0]*blocksize, map_shape[1]*blocksize))
-    
-    #Dictionaries to store item and block heat over time
-    block_temperatures = {'Ground': [], 'Water': [], 'Forest': [], 'Road': [], 'Park': []}
-    item_temperatures = {'Tree': [], 'House': [], 'Bushes': [], 'Street': [], 'MerryGo': [], 'Slide': [], 'Pond': [], 'White_lines' : [], 'Apartment': []}
+#Heat diffusion engines selectable from run_simulation
+DIFFUSION_ENGINES = {
+    'loop': heat_diffusion,
+    'vectorized': heat_diffusion_vectorized,
+}
+
+#Builds the heat diffusion function for the selected engine and solver
+def make_diffusion(engine, raster, solver='explicit', diffusion_rate=0.01, iterations=3, tolerance=None, thermal_field=None, banded_field=None):
+
+    #The whole-map engine diffuses the rasterised map as one field
+    if engine == 'global':
+        return lambda blocks: heat_diffusion_global(blocks, raster, diffusion_rate, iterations, solver)
+
+    #The field engine keeps one temperature field for the whole simulation
+    if engine == 'field':
+        if thermal_field is None:
+            thermal_field = ThermalField(None, raster.map_shape, raster.blocksize, raster)
+        def diffuse(blocks):
+            thermal_field.step(diffusion_rate, iterations, solver, tolerance)
+            return blocks
+        return diffuse
+
+    #The shared engine diffuses the map in row bands on worker processes
+    if engine == 'shared':
+        if solver != 'explicit':
+            raise ValueError(f"The {engine} engine does not support the {solver} solver")
+        if tolerance is not None:
+            raise ValueError(f"The {engine} engine does not support a convergence tolerance")
+        return lambda blocks: heat_diffusion_banded(blocks, raster, banded_field, diffusion_rate, iterations)
+
+    #The per-block engines only have the explicit update
+    if solver != 'explicit':
+        raise ValueError(f"The {engine} engine does not support the {solver} solver")
+    if tolerance is not None:
+        raise ValueError(f"The {engine} engine does not support a convergence tolerance")
+    return lambda blocks: DIFFUSION_ENGINES[engine](blocks, diffusion_rate, iterations)
+
+#Heating and cooldown terms of the thermal equation for each hour of the day
+HOURLY_HEATING = np.array([15 * np.sin((2 * np.pi / 24) * (hour - 7)) for hour in range(24)])
+HOURLY_COOLDOWN = np.array([10 * np.sin((2 * np.pi / 24) * (hour - 19)) for hour in range(24)])
+
+#Equation to calculate block and item heat changing over time, for an array of heat values at once
+def thermal_equation_vectorized(heat_vals, hour, flood_level=0, snow_level=0):
+    if 0 <= hour < 24 and hour == int(hour):
+        heating = HOURLY_HEATING[int(hour)]
+        cooldown = HOURLY_COOLDOWN[int(hour)]
+    else:
+        heating = 15 * np.sin((2 * np.pi / 24) * (hour - 7))
+        cooldown = 10 * np.sin((2 * np.pi / 24) * (hour - 19))
+    temperature = (heat_vals + heating) - cooldown
 
-    for block in blocks:
-        cx_start, ry_start = block.get_topleft()
-        block_heat = thermal_equation(block.get_heat_val(), hour, flood_level, snow_level)
-        thermal_grid[ry_start:ry_start+blocksize, cx_start:cx_start+blocksize] = block_heat
-        block_temperatures[block.get_type()].append(block_heat)
-        
-        for item in block.items:
-            item_heat = thermal_equation(item.get_heat_val(), hour, flood_level, snow_level)
-            x, y = item.get_topleft()
-            size = item.get_size()
-            thermal_grid[ry_start + y:ry_start + y + size[0], cx_start + x:cx_start + x + size[1]] = item_heat
-            item_temperatures[item.get_type()].append(item_heat)
-    
-    return thermal_grid, block_temperatures, item_temperatures
+    #Applying a cooling affect for flooding
+    flood_cooling = 20 * flood_level
+    return np.maximum(0, temperature - flood_cooling)
 
 import random
 
@@ -255,7 +227,17 @@ def apply_snow(image, snow):
     return np.where(snow[:,:,np.newaxis], snow_color, image)
 
 
-def simulate_snow(blocks, snow_intensity, temperature_drop = 30):
+def simulate_snow(blocks, snow_intensity, temperature_drop = 30, raster=None):
+
+    #With a raster every entity is updated at once, with houses and apartments picked by type
+    if raster is not None:
+        heat_vals = raster.get_heat_vals()
+        indoor = raster.registry.get_mask(['House', 'Apartment'])
+        outdoor_temps = np.maximum(heat_vals - temperature_drop, -5)
+        indoor_temps = np.minimum(heat_vals + 15, 25)  # Max indoor temp of 25°C
+        raster.set_heat_vals(np.where(indoor, indoor_temps, outdoor_temps))
+        return
+
     for block in blocks:
         # Decrease outdoor temperature
         new_temp = max(block.get_heat_val() - temperature_drop, -5)  
@@ -272,107 +254,189 @@ def simulate_snow(blocks, snow_intensity, temperature_drop = 30):
                 item_new_temp = min(item.get_heat_val() + 15, 25)  # Max indoor temp of 25°C
                 item.set_heat_val(item_new_temp)
     
+#Snow progress and intensity at an hour of the simulation
+def snow_weather(hour, total_hours):
+    snow_start = 3
+    snow_end = total_hours - 6
+    snow_duration = snow_end - snow_start
+
+    if snow_start <= hour < snow_end:
+        snow_progress = (hour - snow_start) / snow_duration
+        return snow_progress, min(0.1, snow_progress * 0.2)
+    elif hour >= snow_end:
+        return 1, 0.3
+    return 0, 0
+
+#Flood progress and rain intensity at an hour of the simulation
+def rain_weather(hour, total_hours, stop_rain):
+    flood_start = 3
+    flood_end = total_hours - 6
+    flood_duration = flood_end - flood_start
+
+    if flood_start <= hour + stop_rain < flood_end:
+        flood_progress = (hour - flood_start) / flood_duration
+        return flood_progress, min(0.1, flood_progress * 0.2)
+    elif hour >= flood_end:
+        return 1, 0.1  # Maximum rain intensity
+    return 0, 0
+
+#Precomputed weather of a whole simulation. Each weather colour change is
+#scheduled for the first hour its progress threshold is passed.
+class WeatherSchedule:
+    def __init__(self, total_hours, flood, stop_rain, snow):
+        self.flood_progress = np.zeros(total_hours)
+        self.snow_progress = np.zeros(total_hours)
+        self.intensity = np.zeros(total_hours)
+        for hour in range(total_hours):
+            if snow:
+                self.snow_progress[hour], self.intensity[hour] = snow_weather(hour, total_hours)
+            elif flood:
+                self.flood_progress[hour], self.intensity[hour] = rain_weather(hour, total_hours, stop_rain)
+
+        self.events = {}
+        for rule in WEATHER_RULES:
+            kind, types, threshold, colour = rule
+            progress = self.flood_progress if kind == 'flood' else self.snow_progress
+            crossed = np.flatnonzero(progress > threshold)
+            if len(crossed):
+                self.events.setdefault(int(crossed[0]), []).append(rule)
+
+    def get_progress(self, hour):
+        return self.flood_progress[hour], self.snow_progress[hour]
+
+    #Weather colour changes that happen at an hour
+    def get_events(self, hour):
+        return self.events.get(hour, [])
+
+#Shows the canopy and thermal maps of one hour
+def plot_frame(canopy_map, thermal_map, day, hour_of_day):
+    import matplotlib.pyplot as plt
+
+    plt.clf()
+    plt.subplot(1, 2, 1)
+    plt.imshow(canopy_map.astype(np.uint8))
+    plt.title(f"Canopy Map - Day:{day+1:02d}, Time: {hour_of_day:02d}:00")
+    plt.axis("off")
+
+    #Subplotting the thermal map
+    plt.subplot(1, 2, 2)
+    plt.imshow(thermal_map, cmap="jet", vmin=0, vmax=100)
+    plt.title(f"Thermal Map - Day:{day+1:02d}, Time: {hour_of_day:02d}:00")
+    plt.colorbar(label="Temperature (°C)")
+    plt.axis("off")
+
+    plt.pause(0.1)
+
 #Runs the simulation according to set configurations
-def run_simulation(blocks, map_shape, num_days, flood, stop_rain, snow):
-    blocksize = 25
+def run_simulation(blocks, map_shape, num_days, flood, stop_rain, snow, blocksize=25, engine='vectorized', solver='explicit', diffusion_rate=0.01, iterations=3, tolerance=None, frame_cache_bytes=256 * 2**20, stats=None, headless=False, frame_sink=None, pipeline=False, queue_size=2, workers=None, canvas_dir=None, band_rows=256):
     real_temperatures = []
     depicted_temperatures = []
-    block_temp_history = {'Ground': [], 'Water': [], 'Forest': [], 'Road': [], 'Park': []}
-    item_temp_history = {'Tree': [], 'House': [], 'Bushes': [], 'Street': [], 'MerryGo': [], 'Slide': [], 'Pond': [], 'White_lines' : [], 'Apartment': []}
 
-    plt.figure(figsize=(10, 5))
+    #Headless runs never import matplotlib
+    if not headless:
+        import matplotlib.pyplot as plt
+        plt.figure(figsize=(10, 5))
+
+    #Out-of-core canvases are drawn band by band, so the label raster is never painted in memory
+    if canvas_dir is not None and engine not in ['loop', 'vectorized', 'shared']:
+        raise ValueError(f"the {engine} engine diffuses the whole label raster in memory, use the loop, vectorized or shared engine with canvas_dir")
+
+    #The map is rasterised and its entities grouped by type once for the whole simulation
+    raster = MapRaster(blocks, map_shape, blocksize, paint=canvas_dir is None)
+
+    #The field engine keeps one temperature field for the whole simulation
+    thermal_field = None
+    if engine == 'field':
+        thermal_field = ThermalField(blocks, map_shape, blocksize, raster)
+
+    #The shared engine keeps the field and labels in shared memory, painted and stepped by worker processes
+    banded_field = None
+    if engine == 'shared':
+        banded_field = BandedField(raster.shape, workers)
+    diffuse = make_diffusion(engine, raster, solver, diffusion_rate, iterations, tolerance, thermal_field, banded_field)
+
+    #The renderer draws every frame from the raster, keeping rendered
+    #frames to reuse on the following days
+    frame_cache = FrameCache(frame_cache_bytes) if frame_cache_bytes else None
+    renderer = MapRenderer(blocks, map_shape, blocksize, raster, frame_cache)
+
+    #Frames of maps larger than memory are drawn into memory-mapped files instead
+    canvas = MapCanvas(canvas_dir, renderer, band_rows) if canvas_dir is not None else None
     
     #Total no. of hours of the simulation
     total_hours = num_days * 24
-    
-    #Durations of snow and flooding
-    flood_start = 3
-    flood_end = total_hours - 6
-    flood_duration = flood_end - flood_start
 
-    snow_start = 3
-    snow_end = total_hours-6
-    snow_duration = snow_end - snow_start
+    #Weather progress for every hour and the hours the colour changes happen
+    schedule = WeatherSchedule(total_hours, flood, stop_rain, snow)
 
-    for hour in range(total_hours):
-        day = hour // 24
+    #Per-type temperature statistics, preallocated for every hour
+    if stats is None:
+        stats = TemperatureStats(total_hours, raster.registry.types)
+
+    #Physics stage: diffusion, snow and the temperatures of all entities for one hour
+    def simulate_hour(hour):
         hour_of_day = hour % 24
 
         #Applying heat diffusion to blocks
-        blocks = heat_diffusion(blocks)
-        snow_progress = 0
-        flood_progress = 0
+        diffuse(blocks)
+        flood_progress, snow_progress = schedule.get_progress(hour)
+        intensity = schedule.intensity[hour]
       
         #Snows if snow = True
         if snow:    
-            snow_progress = 0
-            snow_intensity = 0
-
-            #Caluculates snow progress and intensity
-            if snow_start <= hour < snow_end:
-                snow_progress = (hour - snow_start) / snow_duration
-                snow_intensity = min(0.1, snow_progress * 0.2)  
-            elif hour >= snow_end:
-                snow_progress = 1
-                snow_intensity = 0.3
-
             #Temperature drop as snow progresses
             temperature_drop = 5 * snow_progress  
-            simulate_snow(blocks, snow_intensity, temperature_drop)
-
-            #Apply snow effects
-            canopy_map = generate_image(blocks, blocksize, map_shape, hour_of_day, flood_progress, snow_progress)
-            snowing = generate_snow(canopy_map.shape[:2], snow_intensity)
-            canop_snow = apply_snow(canopy_map, snowing)
-            thermal_map, block_temperatures, item_temperatures = generate_thermal_image(blocks, blocksize, map_shape, hour_of_day, 0, snow_progress)
-            plt.clf()
-            plt.subplot(1, 2, 1)
-            plt.imshow(canop_snow.astype(np.uint8))
-            plt.title(f"Canopy Map - Day:{day+1:02d}, Time: {hour_of_day:02d}:00")
-            plt.axis("off")
+            simulate_snow(blocks, intensity, temperature_drop, raster)
+
+        #Temperatures of all entities, added to the statistics
+        temperatures = thermal_equation_vectorized(raster.get_heat_vals(), hour_of_day, flood_progress, snow_progress)
+        stats.add(hour, temperatures, raster.registry.type_codes)
+
+        if snow:
+            temperature_drop = 30 * snow_progress  # Adjust temperature drop based on snow progress
+            simulate_snow(blocks, intensity, temperature_drop, raster)
+        return hour, temperatures
+
+    #Render stage: the canopy map with its weather effects and the thermal map
+    def render_hour(step):
+        hour, temperatures = step
+        intensity = schedule.intensity[hour]
+
+        #The canvas draws the weather effects and the thermal map band by band, returning its mean
+        if canvas is not None:
+            canopy_map = canvas.render(hour % 24, snow_colour if snow else rain_colour if flood else None, intensity)
+            renderer.apply_weather(schedule.get_events(hour))
+            depicted_temp = canvas.render_thermal(temperatures)
+            return hour, canopy_map, canvas.thermal, depicted_temp
+
+        canopy_map = renderer.generate_image(hour % 24)
 
+        #Colour changes for the weather thresholds crossed this hour show from the next frame on
+        renderer.apply_weather(schedule.get_events(hour))
+
+        #Apply snow or rain effects
+        if snow:
+            canopy_map = apply_snow(canopy_map, generate_snow(canopy_map.shape[:2], intensity))
         elif flood:
-            flood_progress = 0
-            rain_intensity = 0
-
-            #Calculates flood progress and intensity
-            if flood and flood_start <= hour+stop_rain < flood_end:
-                flood_progress = (hour - flood_start) / flood_duration
-                rain_intensity = min(0.1, flood_progress * 0.2) 
-            elif flood and hour >= flood_end:
-                flood_progress = 1
-                rain_intensity = 0.1  # Maximum rain intensity
-
-            #Apply rain effects
-            canopy_map = generate_image(blocks, blocksize, map_shape, hour_of_day, flood_progress, snow_progress)
-            rain = generate_rain(canopy_map.shape[:2], rain_intensity)
-            canopy_rain = apply_rain(canopy_map, rain)
-            thermal_map, block_temperatures, item_temperatures = generate_thermal_image(blocks, blocksize, map_shape, hour_of_day, flood_progress)
-            plt.clf()
-            plt.subplot(1, 2, 1)
-            plt.imshow(canopy_rain.astype(np.uint8))
-            plt.title(f"Canopy Map - Day:{day+1:02d}, Time: {hour_of_day:02d}:00")
-            plt.axis("off")
-
-        else:
-            #Generates normal map
-            thermal_map, block_temperatures, item_temperatures = generate_thermal_image(blocks, blocksize, map_shape, hour_of_day)
-            canopy_map = generate_image(blocks, blocksize, map_shape, hour_of_day, flood_progress, snow_progress)
-
-            plt.clf()
-            plt.subplot(1, 2, 1)
-            plt.imshow(canopy_map.astype(np.uint8))
-            plt.title(f"Canopy Map - Day:{day+1:02d}, Time: {hour_of_day:02d}:00")
-            plt.axis("off")
-
-        #Subplotting the thermal map
-        plt.subplot(1, 2, 2)
-        plt.imshow(thermal_map, cmap="jet", vmin=0, vmax=100)
-        plt.title(f"Thermal Map - Day:{day+1:02d}, Time: {hour_of_day:02d}:00")
-        plt.colorbar(label="Temperature (°C)")
-        plt.axis("off")
-
-        plt.pause(0.1)
+            canopy_map = apply_rain(canopy_map, generate_rain(canopy_map.shape[:2], intensity))
+
+        #Temperatures painted into the thermal map
+        thermal_map = temperatures[raster.labels]
+        return hour, canopy_map, thermal_map, np.mean(thermal_map)
+
+    #Output stage: frames, plots and the real and depicted temperatures
+    def output_hour(frame):
+        hour, canopy_map, thermal_map, depicted_temp = frame
+        day = hour // 24
+        hour_of_day = hour % 24
+        flood_progress, snow_progress = schedule.get_progress(hour)
+
+        #Streams the frames to disk from the sink's writer thread
+        if frame_sink is not None:
+            frame_sink.write(hour, canopy_map, thermal_map)
+
+        if not headless:
+            plot_frame(canopy_map, thermal_map, day, hour_of_day)
         print(f"Timestep {hour_of_day:02d}:00, {'Snow' if snow else 'Flood'} Progress: {snow_progress if snow else flood_progress:.2f}")
 
         #Calculating the real temperature based on the time of the day
@@ -383,29 +447,47 @@ def run_simulation(blocks, map_shape, num_days, flood, stop_rain, snow):
         #Adjusting real temperature based on flooding and snowing
         if snow:
             real_temp -= snow_cooling
-            temperature_drop = 30 * snow_progress  # Adjust temperature drop based on snow progress
-            simulate_snow(blocks, snow_intensity, temperature_drop)
         elif flood:
             real_temp -= flood_cooling
 
-        #Calculating the average given temperature and storing real and given temperatures
-        depicted_temp = np.mean(thermal_map)
+        #Storing real and given temperatures
         real_temperatures.append(real_temp)
         depicted_temperatures.append(depicted_temp)
         print(f"Timestep {hour_of_day:02d}:00, Real Temp: {real_temp:.2f}, Depicted Temp: {depicted_temp:.2f}")
-        
-        #Storing temperature history of blocks
-        for block_type, temps in block_temperatures.items():
-            block_temp_history[block_type].append(np.mean(temps))
 
-        #Storing temperature history of items
-        for item_type, temps in item_temperatures.items():
-            item_temp_history[item_type].append(np.mean(temps))
-    
-    plt.close()
+    #Pipelined, the physics of the next hour runs while the current one is
+    #rendered and written, otherwise the stages run one after another
+    stages = Pipeline([('physics', simulate_hour), ('render', render_hour), ('output', output_hour)], queue_size)
+    start_time = time.perf_counter()
+    try:
+        stages.run(range(total_hours), threaded=pipeline)
+    finally:
+        if banded_field is not None:
+            banded_field.close()
+        if canvas is not None:
+            canvas.flush()
+    elapsed = time.perf_counter() - start_time
+    if not headless:
+        plt.close()
+    print(f"Simulated {total_hours} steps in {elapsed:.2f} s ({total_hours / elapsed:.2f} steps per second)")
+    print(stages)
+
+    #Mean temperature history of every block and item type
+    block_temp_history = stats.get_history(BLOCK_TYPES)
+    item_temp_history = stats.get_history(ITEM_TYPES)
+
+    if frame_cache is not None:
+        print(frame_cache)
+    if canvas is not None:
+        print(canvas)
+
+    #Reports how much diffusion work the convergence check saved
+    if thermal_field is not None and tolerance is not None:
+        print(f"Diffusion iterations performed: {thermal_field.total_iterations} of {total_hours * iterations}")
     return real_temperatures, depicted_temperatures, block_temp_history, item_temp_history
 
 def plot_results(real_temperatures, depicted_temperatures, block_temp_history, item_temp_history):
+    import matplotlib.pyplot as plt
 
     # Plot real vs depicted temperature
     plt.figure()
@@ -495,43 +577,166 @@ def get_scenario_config(scenario):
             'snow': False
         }
         
+#Saves the results of a run to an output directory
+def save_results(output_dir, config, real_temperatures, depicted_temperatures, stats):
+    os.makedirs(output_dir, exist_ok=True)
+    filename = os.path.join(output_dir, 'results.npz')
+    np.savez(filename,
+             real_temperatures=np.array(real_temperatures),
+             depicted_temperatures=np.array(depicted_temperatures),
+             history=stats.to_array(),
+             config=np.array(json.dumps(config)))
+    print(f"Results saved to {filename}")
+
+#Command line options that override the scenario configuration
+CONFIG_OPTIONS = {
+    'rows': 'rows',
+    'cols': 'cols',
+    'blocksize': 'blocksize',
+    'days': 'num_days',
+    'forest': 'add_forests',
+    'parks': 'add_parks',
+    'stop_rain': 'stop_rain',
+}
+
 def main():
     
     #Run map with different scenerios called from command line inputs
     parser = argparse.ArgumentParser(description="Run map simulation with different scenarios.")
     parser.add_argument('scenario', nargs='?', choices=['snow', 'rain', 'normal'], help="Specify a scenario (snow or rain or normal map)") 
+    parser.add_argument('--headless', action='store_true', help="Run without any plotting and report steps per second")
+
+    #Map and scenario options, any of them skips the interactive inputs
+    map_options = parser.add_argument_group("map options", "Override the scenario preset (normal if no scenario is given)")
+    map_options.add_argument('--rows', type=int, help="No. of block rows")
+    map_options.add_argument('--cols', type=int, help="No. of block columns")
+    map_options.add_argument('--blocksize', type=int, help="Size of a block in pixels (at least 25)")
+    map_options.add_argument('--days', type=int, help="No. of days to simulate")
+    map_options.add_argument('--forest', action=argparse.BooleanOptionalAction, help="Add or skip the forest")
+    map_options.add_argument('--parks', action=argparse.BooleanOptionalAction, help="Add or skip the parks")
+    map_options.add_argument('--stop-rain', type=int, help="Hours before the rain stops")
+    map_options.add_argument('--seed', type=int, help="Seed for the random map and weather")
+    map_options.add_argument('--store', action='store_true', help="Keep the map in a columnar EntityStore, generated in bulk as with --bulk")
+    map_options.add_argument('--bulk', action='store_true', help="Generate the map from a type grid straight into an EntityStore")
+    map_options.add_argument('--save-map', metavar='FILE', help="Save the generated map and its seed to an npz snapshot")
+    map_options.add_argument('--load-map', metavar='FILE', help="Load the map from a snapshot instead of generating it")
+
+    #Simulation engine options
+    engine_options = parser.add_argument_group("engine options")
+    engine_options.add_argument('--engine', choices=['loop', 'vectorized', 'global', 'field', 'shared'], default='vectorized', help="Heat diffusion engine")
+    engine_options.add_argument('--solver', choices=['explicit', 'implicit'], default='explicit', help="Diffusion solver of the global and field engines")
+    engine_options.add_argument('--diffusion-rate', type=float, default=0.01, help="Diffusion rate, or the timestep of the implicit solver")
+    engine_options.add_argument('--iterations', type=int, default=3, help="Diffusion steps per hour")
+    engine_options.add_argument('--tolerance', type=float, help="Stop diffusing once nothing changes by more than this (field engine)")
+    engine_options.add_argument('--frame-cache-mb', type=float, default=256, help="Size of the rendered frame cache, 0 to disable it")
+    engine_options.add_argument('--workers', type=int, help="Worker processes of the shared engine (default: one per CPU)")
+    engine_options.add_argument('--pipeline', action='store_true', help="Overlap the physics, rendering and output of consecutive hours in separate threads")
+
+    parser.add_argument('--output-dir', help="Directory to save the results to")
+    parser.add_argument('--frames', choices=['ppm', 'raw'], help="Also save every frame to OUTPUT_DIR/frames as PPM images or raw rgb24 video")
+    parser.add_argument('--canvas-dir', help="Draw the frames band by band into memory-mapped files in this directory, for maps larger than memory")
+    parser.add_argument('--band-rows', type=int, default=256, help="Pixel rows of the memory-mapped frames drawn at a time")
     args = parser.parse_args()
 
-    #Checks if the scenerio is specified
-    if args.scenario:
-        config = get_scenario_config(args.scenario)
-        if config:
-            print(f"Running {args.scenario} scenario with preset configuration.")
-            blocksize = config['blocksize']
-            rows = config['rows']
-            cols = config['cols']
-            num_days = config['num_days']
-            add_forests = config['add_forests']
-            add_parks = config['add_parks']
-            flood = config['flood']
-            stop_rain = config['stop_rain']
-            snow = config['snow']
-        else:
-            print(f"Unknown scenario: {args.scenario}")
-            return
+    if args.engine in ['loop', 'vectorized', 'shared'] and args.solver != 'explicit':
+        parser.error(f"the {args.engine} engine only has the explicit solver")
+    if args.frames and not args.output_dir:
+        parser.error("--frames needs --output-dir")
+    if args.tolerance is not None and args.engine != 'field':
+        parser.error("--tolerance needs the field engine")
+    if args.workers is not None and (args.engine != 'shared' or args.workers <= 0):
+        parser.error("--workers needs the shared engine and a positive number of workers")
+    if args.canvas_dir and (not args.headless or args.frames or args.engine not in ['loop', 'vectorized', 'shared']):
+        parser.error("--canvas-dir needs --headless and the loop, vectorized or shared engine, and can not be combined with --frames")
+    if args.band_rows <= 0:
+        parser.error("--band-rows must be positive")
+    if args.load_map and (args.save_map or args.store or args.bulk or any(getattr(args, option) is not None for option in ['rows', 'cols', 'blocksize', 'forest', 'parks'])):
+        parser.error("--load-map can not be combined with options that generate the map")
+
+    overrides = {key: getattr(args, option) for option, key in CONFIG_OPTIONS.items() if getattr(args, option) is not None}
+
+    #Any command line argument makes the run non-interactive, so batch runs never wait for input
+    if sys.argv[1:]:
+        scenario = args.scenario or 'normal'
+        config = get_scenario_config(scenario)
+        config.update(overrides)
+        print(f"Running {scenario} scenario with {'custom' if overrides else 'preset'} configuration.")
+        blocksize = config['blocksize']
+        rows = config['rows']
+        cols = config['cols']
+        num_days = config['num_days']
+        add_forests = config['add_forests']
+        add_parks = config['add_parks']
+        flood = config['flood']
+        stop_rain = config['stop_rain']
+        snow = config['snow']
+
+        #Same limits as the interactive inputs
+        if rows <= 0 or cols <= 0 or rows * cols < 12:
+            parser.error("the map needs positive rows and columns and at least 12 blocks")
+        if blocksize < 25:
+            parser.error("--blocksize must be at least 25")
+        if num_days <= 0:
+            parser.error("--days must be positive")
+        if stop_rain < 0:
+            parser.error("--stop-rain can not be negative")
+        if args.stop_rain is not None and not flood:
+            parser.error("--stop-rain only applies to the rain scenario")
     else:
         #Gets user inputs to run the simulation
         print("Running simulation with user input.")
         blocksize, rows, cols, num_days, add_forests, add_parks, flood, stop_rain, snow = user_inputs()
 
+    #Loads the map from a snapshot, with its seed for the weather unless another one is given
+    seed = args.seed
+    if args.load_map:
+        blocks, map_shape, info = load_map(args.load_map)
+        rows, cols = map_shape
+        blocksize, add_forests, add_parks = info['blocksize'], info['add_forests'], info['add_parks']
+        seed = seed if seed is not None else info['seed']
+        print(f"Loaded a {rows}x{cols} map from {args.load_map}")
+
+    #A saved map always gets a seed, so the runs using it can be repeated
+    if seed is None and args.save_map:
+        seed = int(np.random.SeedSequence().generate_state(1)[0])
+
+    #Seeds the random map and weather so runs can be repeated
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+
     #Creates the map with specific parameters
-    blocks, map_shape = make_map(blocksize, rows, cols, add_forests, add_parks)
+    if not args.load_map:
+        store = EntityStore() if args.store or args.bulk else None
+        blocks, map_shape = make_map(blocksize, rows, cols, add_forests, add_parks, store=store, bulk=args.bulk)
+        if args.save_map:
+            save_map(args.save_map, blocks, map_shape, blocksize, seed, add_forests, add_parks)
+            print(f"Map saved to {args.save_map}")
     
     # Runs the simulation
-    real_temperatures, depicted_temperatures, block_temp_history, item_temp_history = run_simulation(blocks, map_shape, num_days, flood, stop_rain, snow)
+    stats = TemperatureStats(num_days * 24, BLOCK_TYPES + ITEM_TYPES)
+    frame_sink = FrameSink(os.path.join(args.output_dir, 'frames'), args.frames) if args.frames else None
+    try:
+        real_temperatures, depicted_temperatures, block_temp_history, item_temp_history = run_simulation(
+            blocks, map_shape, num_days, flood, stop_rain, snow, blocksize,
+            engine=args.engine, solver=args.solver, diffusion_rate=args.diffusion_rate, iterations=args.iterations,
+            tolerance=args.tolerance, frame_cache_bytes=int(args.frame_cache_mb * 2**20), stats=stats,
+            headless=args.headless, frame_sink=frame_sink, pipeline=args.pipeline,
+            workers=args.workers, canvas_dir=args.canvas_dir, band_rows=args.band_rows)
+    finally:
+        if frame_sink is not None:
+            frame_sink.close()
+
+    if args.output_dir:
+        config = {'blocksize': blocksize, 'rows': rows, 'cols': cols, 'num_days': num_days, 'add_forests': add_forests,
+                  'add_parks': add_parks, 'flood': flood, 'stop_rain': stop_rain, 'snow': snow, 'seed': seed,
+                  'engine': args.engine, 'solver': args.solver, 'diffusion_rate': args.diffusion_rate,
+                  'iterations': args.iterations, 'tolerance': args.tolerance}
+        save_results(args.output_dir, config, real_temperatures, depicted_temperatures, stats)
 
     # Plots the results
-    plot_results(real_temperatures, depicted_temperatures, block_temp_history, item_temp_history)
+    if not args.headless:
+        plot_results(real_temperatures, depicted_temperatures, block_temp_history, item_temp_history)
 
     # Prints a summary table of the item and block given temperature vs real temperature 
     print("\n\nItem Temperatures Table (Real vs Depicted)")
@@ -1,6 +1,7 @@
 import random
 import numpy as np
 from objects import *  # Assuming this file contains all the block and item classes
+from entity_store import EntityStore
 import csv
 import os
 
@@ -27,32 +28,113 @@ def csv_read(filename):
 
     return house_colors, tree_colors
 
-#Appending blocks
+#Row and column offsets of the up, down, left and right neighbours of a cell,
+#followed by the up-left, up-right, down-left and down-right ones
+NEIGHBOUR_OFFSETS = [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]
+
+#Flat row-major indices of the neighbours of every cell of a grid, in the
+#order of NEIGHBOUR_OFFSETS, -1 past the edges. Only the first four
+#neighbours unless diagonal is set.
+def neighbour_table(map_shape, diagonal=False):
+    rows, cols = map_shape
+    offsets = NEIGHBOUR_OFFSETS if diagonal else NEIGHBOUR_OFFSETS[:4]
+    cells = np.arange(rows * cols).reshape(rows, cols)
+    table = np.full((rows, cols, len(offsets)), -1, dtype=np.int64)
+    for k, (dr, dc) in enumerate(offsets):
+        table[max(-dr, 0):rows - max(dr, 0), max(-dc, 0):cols - max(dc, 0), k] = cells[max(dr, 0):rows + min(dr, 0), max(dc, 0):cols + min(dc, 0)]
+    return table.reshape(-1, len(offsets))
+
+#Blocks of a map on a grid of cells, one block per cell. Blocks are looked up
+#by (row, col), and putting a block in a cell replaces the block that was
+#there. Iterating gives the blocks row by row.
+class BlockGrid:
+    def __init__(self, map_shape, blocksize):
+        self.map_shape = tuple(map_shape)
+        self.blocksize = blocksize
+        self.cells = [[None] * map_shape[1] for _ in range(map_shape[0])]
+
+    #Grid of the blocks of a list, each put in the cell of its top left corner
+    @classmethod
+    def from_blocks(cls, blocks, map_shape, blocksize):
+        grid = cls(map_shape, blocksize)
+        for block in blocks:
+            grid[grid.get_cell(block)] = block
+        return grid
+
+    def __getitem__(self, cell):
+        row, col = cell
+        return self.cells[row][col]
+
+    def __setitem__(self, cell, block):
+        row, col = cell
+        self.cells[row][col] = block
+
+    def __iter__(self):
+        for row in self.cells:
+            for block in row:
+                if block is not None:
+                    yield block
+
+    def __len__(self):
+        return sum(block is not None for row in self.cells for block in row)
+
+    #Cell of a block, from its top left corner
+    def get_cell(self, block):
+        x, y = block.get_topleft()
+        return y // self.blocksize, x // self.blocksize
+
+    #Blocks around a cell in the order of NEIGHBOUR_OFFSETS, skipping the
+    #edges of the map and empty cells
+    def get_neighbours(self, row, col, diagonal=False):
+        offsets = NEIGHBOUR_OFFSETS if diagonal else NEIGHBOUR_OFFSETS[:4]
+        neighbours = []
+        for dr, dc in offsets:
+            r, c = row + dr, col + dc
+            if 0 <= r < self.map_shape[0] and 0 <= c < self.map_shape[1] and self.cells[r][c] is not None:
+                neighbours.append(self.cells[r][c])
+        return neighbours
+
+    #Flat row-major cell indices of the neighbours of every cell, -1 past the edges
+    def get_neighbour_table(self, diagonal=False):
+        return neighbour_table(self.map_shape, diagonal)
+
+    #Cells holding a block of the given type
+    def get_cells(self, block_type):
+        return [(row, col) for row in range(self.map_shape[0]) for col in range(self.map_shape[1])
+                if self.cells[row][col] is not None and self.cells[row][col].get_type() == block_type]
+
+    #Block type of every cell as an index into BLOCK_TYPES, -1 for empty cells
+    def get_type_grid(self):
+        codes = {block_type: code for code, block_type in enumerate(BLOCK_TYPES)}
+        return np.array([[codes[block.get_type()] if block is not None else -1 for block in row] for row in self.cells], dtype=np.int16)
+
+#Filling the grid with ground and water blocks
 def place_blocks(map_shape, blocksize):
-    blocks = []
+    blocks = BlockGrid(map_shape, blocksize)
 
     # Placing Ground blocks
     for i in range(map_shape[0] - 1):
         for j in range(map_shape[1] - 1):
-            blocks.append(Ground(blocksize, (blocksize * j, blocksize * i)))
+            blocks[i, j] = Ground(blocksize, (blocksize * j, blocksize * i))
 
     # Placing Water blocks
     for i in range(map_shape[0]):
         for j in range(map_shape[1] - 1, map_shape[1]):
-            blocks.append(Water(blocksize, (blocksize * j, blocksize * i)))
+            blocks[i, j] = Water(blocksize, (blocksize * j, blocksize * i))
     for i in range(map_shape[0] - 1, map_shape[0]):
         for j in range(map_shape[1]):
-            blocks.append(Water(blocksize, (blocksize * j, blocksize * i)))
+            blocks[i, j] = Water(blocksize, (blocksize * j, blocksize * i))
 
     return blocks
 
 #Adding forests and items
 def add_forest(blocks, map_shape, blocksize, tree_colors):
+    #The 2x2 forest in the top left corner, clipped to the map as in make_type_grid
     forest = []
-    for i in range(2):
-        for j in range(2): 
-            blocks.append(Forest(blocksize, (blocksize * j, blocksize * i)))
-            forest.append(len(blocks) - 1)
+    for i in range(min(2, map_shape[0])):
+        for j in range(min(2, map_shape[1])):
+            blocks[i, j] = Forest(blocksize, (blocksize * j, blocksize * i))
+            forest.append((i, j))
 
     default_tree_color = np.array([40, 200, 23])
     
@@ -63,53 +145,129 @@ def add_forest(blocks, map_shape, blocksize, tree_colors):
 
     return blocks, forest
 
+#Per-block occupancy bitmaps of a set of blocks, used to place items without
+#overlap by sampling directly from the free positions of all blocks at once
+class OccupancyGrid:
+    def __init__(self, count, blocksize):
+        self.blocksize = blocksize
+        self.occupied = np.zeros((count, blocksize, blocksize), dtype=bool)
+
+    def __len__(self):
+        return len(self.occupied)
+
+    #Marks one rectangle in each of the given blocks as occupied, grown by a margin on every side
+    def occupy(self, block_indices, x, y, height, width, margin=0):
+        cells = np.arange(self.blocksize)
+        rows = (cells >= (y - margin)[:, None]) & (cells < (y + height + margin)[:, None])
+        cols = (cells >= (x - margin)[:, None]) & (cells < (x + width + margin)[:, None])
+        self.occupied[block_indices] |= rows[:, :, None] & cols[:, None, :]
+
+    #True for every top left corner where a size x size item fits on free cells, for every block
+    def get_free(self, size):
+        span = self.blocksize - size + 1
+        rows = self.occupied[:, :span].copy()
+        for k in range(1, size):
+            rows |= self.occupied[:, k:k + span]
+        blocked = rows[:, :, :span].copy()
+        for k in range(1, size):
+            blocked |= rows[:, :, k:k + span]
+        return ~blocked
+
+    #Picks a uniformly random free top left corner for a size x size item in
+    #every block that still has room and marks it as occupied. Returns the
+    #blocks the item was placed in and the corners.
+    def place(self, size):
+        free = self.get_free(size)
+        row_totals = free.sum(axis=2, dtype=np.int32).cumsum(axis=1)
+        counts = row_totals[:, -1]
+        placed = np.flatnonzero(counts > 0)
+
+        #The pick-th free corner of every block, counting from 0, found by
+        #its row first and then by its column within the row
+        picks = np.minimum(np.random.random(len(placed)) * counts[placed], counts[placed] - 1).astype(np.int32)
+        row_totals = row_totals[placed]
+        y = (row_totals <= picks[:, None]).sum(axis=1)
+        picks -= np.where(y > 0, row_totals[np.arange(len(placed)), y - 1], 0)
+        x = (free[placed, y].cumsum(axis=1) <= picks[:, None]).sum(axis=1)
+
+        #Footprints are marked one cell offset at a time
+        for dy in range(size):
+            for dx in range(size):
+                self.occupied[placed, y + dy, x + dx] = True
+        return placed, x, y
+
+#Random colours from colours for count items, or the default colour for all of them
+def random_colours(colours, default_colour, count):
+    if not colours:
+        return np.tile(default_colour, (count, 1))
+    return np.array(colours)[np.random.randint(len(colours), size=count)]
+
+#Households of the ground blocks: the building class, its height, width,
+#boundary and the ranges of its centre, then the class, size and number of
+#the trees or bushes around it
+HOUSEHOLDS = {
+    'House': (House, 6, 12, 5, (6, 19), (3, 22), Tree, 5, 5),
+    'Apartment': (Apartment, 8, 16, 6, (8, 17), (4, 21), Bushes, 3, 10),
+}
+
+#Positions of a building in each of count blocks and of up to greenery_count
+#trees or bushes around it. The building keeps its boundary clear and no two
+#items overlap. Blocks are placed in chunks to bound the memory of the
+#occupancy bitmaps. Returns the building centres, and the block, rank and
+#centre of every tree or bush.
+def place_buildings(count, blocksize, height, width, boundary, x_range, y_range, greenery_size, greenery_count, chunk_size=16384):
+    pos_x = np.random.randint(x_range[0], x_range[1] + 1, size=count)
+    pos_y = np.random.randint(y_range[0], y_range[1] + 1, size=count)
+
+    placed_blocks, ranks, greenery_x, greenery_y = [], [], [], []
+    for start in range(0, count, chunk_size):
+        stop = min(start + chunk_size, count)
+        grid = OccupancyGrid(stop - start, blocksize)
+        grid.occupy(np.arange(stop - start), pos_x[start:stop] - width // 2, pos_y[start:stop] - height // 2, height, width, margin=boundary)
+
+        #One item in every block with room left per round
+        for rank in range(1, greenery_count + 1):
+            placed, x, y = grid.place(greenery_size)
+            if len(placed) == 0:
+                break
+            placed_blocks.append(placed + start)
+            ranks.append(np.full(len(placed), rank))
+            greenery_x.append(x + greenery_size // 2)
+            greenery_y.append(y + greenery_size // 2)
+    greenery = tuple(np.concatenate(column) if column else np.zeros(0, dtype=np.int64) for column in [placed_blocks, ranks, greenery_x, greenery_y])
+    return pos_x, pos_y, greenery
+
+#Adds a household to every one of the given blocks
+def add_buildings(blocks, block_indices, blocksize, household, house_colors, default_house_color, tree_colors, default_tree_color):
+    building, height, width, boundary, x_range, y_range, greenery, greenery_size, greenery_count = HOUSEHOLDS[household]
+    pos_x, pos_y, (placed, _, x, y) = place_buildings(len(block_indices), blocksize, height, width, boundary, x_range, y_range, greenery_size, greenery_count)
+
+    colours = random_colours(house_colors, default_house_color, len(block_indices))
+    for block_index, house_x, house_y, colour in zip(block_indices, pos_x.tolist(), pos_y.tolist(), colours):
+        blocks[block_index].add_item(building((house_x, house_y), colour, height, width, boundary=boundary))
+
+    #Trees and bushes come by round, so every block gets them in rank order
+    colours = random_colours(tree_colors, default_tree_color, len(placed))
+    for index, tree_x, tree_y, colour in zip(placed.tolist(), x.tolist(), y.tolist(), colours):
+        blocks[block_indices[index]].add_item(greenery((tree_x, tree_y), colour, greenery_size))
+    return blocks
+
 #Adding houses and apartments
 def add_household(blocks, map_shape, blocksize, house_colors, tree_colors):
     default_house_color = np.array([154, 200, 53])
     default_tree_color = np.array([40, 200, 23])
 
-    for i in range(map_shape[0] - 1):
+    #Houses with trees on every third row of ground blocks, apartments with bushes on the others
+    house_blocks = []
+    apartment_blocks = []
+    for i, j in blocks.get_cells('Ground'):
         if i % 3 == 0:
-            for j in range(map_shape[1] - 1):
-                block_index = i * (map_shape[1] - 1) + j
-                house_color = random.choice(house_colors) if house_colors else default_house_color
-                house = House((random.randint(6,19), random.randint(3,22)), house_color, 6, 12, boundary=5)
-                blocks[block_index].add_item(house)    
-                trees = 0
-                attempts = 0
-                tree_size = 5
-                while trees < 5 and attempts < 50:
-                    tree_x = random.randint(3, 22)
-                    tree_y = random.randint(3, 22)
-
-                    #Overlay handling for the house
-                    if not house.boundry_setting(tree_x, tree_y) and not house.boundry_setting(tree_x + tree_size, tree_y + tree_size):
-                        tree_color = random.choice(tree_colors) if tree_colors else default_tree_color
-                        success = blocks[block_index].add_item(Tree((tree_x, tree_y), tree_color, tree_size))
-                        if success:
-                            trees += 1
-                    attempts += 1
-            
+            house_blocks.append((i, j))
         else:
-            for j in range(map_shape[1]-1):
-                block_index = i * (map_shape[1]-1)+j
-                house_color = random.choice(house_colors) if house_colors else default_house_color
-                apartment = Apartment((random.randint(8,17),random.randint(4,21)), house_color, 8, 16, boundary=6)
-                blocks[block_index].add_item(apartment)
-                bushes = 0
-                attempts = 0
-                bushes_size = 3
-                while bushes < 10 and attempts < 50:
-                    bushes_x = random.randint(3,22)
-                    bushes_y = random.randint(3, 22)
-
-                    #Overlay handling for the apartment
-                    if not apartment.boundry_setting(bushes_x, bushes_y) and not apartment.boundry_setting(bushes_x + bushes_size, bushes_y + bushes_size):
-                        tree_color = random.choice(tree_colors) if tree_colors else default_tree_color
-                        success = blocks[block_index].add_item(Bushes((bushes_x, bushes_y), tree_color, bushes_size))
-                        if success:
-                            bushes += 1
-                    attempts += 1
+            apartment_blocks.append((i, j))
+
+    blocks = add_buildings(blocks, house_blocks, blocksize, 'House', house_colors, default_house_color, tree_colors, default_tree_color)
+    blocks = add_buildings(blocks, apartment_blocks, blocksize, 'Apartment', house_colors, default_house_color, tree_colors, default_tree_color)
     return blocks
 
 #Adding roads and items
@@ -119,8 +277,8 @@ def add_roads(blocks, map_shape, blocksize, tree_colors):
     for i in range(map_shape[0] - 1):
         if i % 5 == 4:
             for j in range(map_shape[1]):
-                blocks.append(Road(blocksize, (blocksize * j, blocksize * i)))
-                roads.append(len(blocks) - 1)
+                blocks[i, j] = Road(blocksize, (blocksize * j, blocksize * i))
+                roads.append((i, j))
 
     for road_index in roads:
         blocks[road_index].add_item(Street((int(12.5), int(12.5)), 15, 25))
@@ -139,8 +297,8 @@ def adding_park(blocks, map_shape, blocksize, tree_colors):
         if i % 5 == 3:
             for j in range(map_shape[1] - 1):
                 if j % 7 == 1:
-                    blocks.append(Park(blocksize, (blocksize * j, blocksize * i)))
-                    parks.append(len(blocks) - 1)
+                    blocks[i, j] = Park(blocksize, (blocksize * j, blocksize * i))
+                    parks.append((i, j))
 
     for parks_index in parks:
         c = 3
@@ -157,10 +315,135 @@ def adding_park(blocks, map_shape, blocksize, tree_colors):
 
     return blocks, parks
 
-#Setting up the map.
-def make_map(blocksize, rows, cols, add_forests, add_parks, csv_filename='colours.csv'):
+#Block type of every cell of a map, as an index into BLOCK_TYPES. Forests,
+#roads and parks take the place of the ground and water under them.
+def make_type_grid(map_shape, add_forests, add_parks):
+    codes = {block_type: code for code, block_type in enumerate(BLOCK_TYPES)}
+    type_grid = np.full(map_shape, codes['Ground'], dtype=np.int16)
+    type_grid[:, -1] = codes['Water']
+    type_grid[-1, :] = codes['Water']
+    if add_forests:
+        type_grid[:2, :2] = codes['Forest']
+
+    rows = np.arange(map_shape[0] - 1)
+    cols = np.arange(map_shape[1] - 1)
+    type_grid[rows[rows % 5 == 4], :] = codes['Road']
+    if add_parks:
+        type_grid[np.ix_(rows[rows % 5 == 3], cols[cols % 7 == 1])] = codes['Park']
+    return type_grid
+
+#Items of one kind for many blocks: the cells of their blocks, their rank
+#within the block, an item they copy their type, size, heat value and
+#default colour from, and their positions and colours if they differ
+class ItemBatch:
+    def __init__(self, cells, rank, prototype, pos=None, colours=None):
+        self.cells = np.asarray(cells, dtype=np.int64)
+        self.ranks = np.broadcast_to(rank, self.cells.shape)
+        self.prototype = prototype
+        self.pos = np.broadcast_to(prototype.pos if pos is None else pos, self.cells.shape + (2,))
+        self.colours = np.broadcast_to(prototype.get_base_colour() if colours is None else colours, self.cells.shape + (3,))
+
+    def __len__(self):
+        return len(self.cells)
+
+#Items of every block of a type grid, the same items the add_ functions give
+#the blocks, with every random position and colour drawn in batches
+def make_item_batches(type_grid, blocksize, house_colors, tree_colors):
+    default_house_color = np.array([154, 200, 53])
+    default_tree_color = np.array([40, 200, 23])
+    cols = type_grid.shape[1]
+    block_types = type_grid.ravel()
+    batches = []
+
+    #30 trees in every forest block
+    forest = np.flatnonzero(block_types == BLOCK_TYPES.index('Forest'))
+    cells = np.repeat(forest, 30)
+    batches.append(ItemBatch(cells, np.tile(np.arange(30), len(forest)), Tree((0, 0), default_tree_color, 5),
+                             np.random.randint(4, 23, size=(len(cells), 2)), random_colours(tree_colors, default_tree_color, len(cells))))
+
+    #Houses on every third row of ground blocks, apartments on the others
+    ground = np.flatnonzero(block_types == BLOCK_TYPES.index('Ground'))
+    house_rows = (ground // cols) % 3 == 0
+    for household, cells in [('House', ground[house_rows]), ('Apartment', ground[~house_rows])]:
+        building, height, width, boundary, x_range, y_range, greenery, greenery_size, greenery_count = HOUSEHOLDS[household]
+        pos_x, pos_y, (placed, ranks, x, y) = place_buildings(len(cells), blocksize, height, width, boundary, x_range, y_range, greenery_size, greenery_count)
+        batches.append(ItemBatch(cells, 0, building((0, 0), default_house_color, height, width, boundary),
+                                 np.stack([pos_x, pos_y], axis=1), random_colours(house_colors, default_house_color, len(cells))))
+        batches.append(ItemBatch(cells[placed], ranks, greenery((0, 0), default_tree_color, greenery_size),
+                                 np.stack([x, y], axis=1), random_colours(tree_colors, default_tree_color, len(placed))))
+
+    #Street, white lines and two bushes on every road block
+    roads = np.flatnonzero(block_types == BLOCK_TYPES.index('Road'))
+    road_colours = random_colours(tree_colors, default_tree_color, len(roads))
+    batches.append(ItemBatch(roads, 0, Street((int(12.5), int(12.5)), 15, 25)))
+    batches.append(ItemBatch(roads, 1, White_lines((5, 13), 1, 5)))
+    batches.append(ItemBatch(roads, 2, Bushes((6, 22), default_tree_color, 3), colours=road_colours))
+    batches.append(ItemBatch(roads, 3, Bushes((6, 2), default_tree_color, 3), colours=road_colours))
+
+    #Bushes along two sides, a merry-go-round, a slide, a tree and a pond in every park
+    parks = np.flatnonzero(block_types == BLOCK_TYPES.index('Park'))
+    for k in range(4):
+        c = 3 + 5 * k
+        bush_colours = random_colours(tree_colors, default_tree_color, len(parks))
+        batches.append(ItemBatch(parks, 2 * k, Bushes((c, int(2.5)), default_tree_color, 3), colours=bush_colours))
+        batches.append(ItemBatch(parks, 2 * k + 1, Bushes((int(2.5), c), default_tree_color, 3), colours=bush_colours))
+    batches.append(ItemBatch(parks, 8, MerryGo((20, 20), np.array([150, 50, 50]), 8)))
+    batches.append(ItemBatch(parks, 9, Slide((10, 20), np.array([150, 50, 150]), 4)))
+    batches.append(ItemBatch(parks, 10, Tree((20, 10), default_tree_color, 5), colours=random_colours(tree_colors, default_tree_color, len(parks))))
+    batches.append(ItemBatch(parks, 11, Pond((10, 12), 7)))
+    return batches
+
+#Generates a whole map straight into the columns of an EntityStore, in
+#painting order with each block followed by its items. Returns the type grid.
+def generate_map(blocksize, map_shape, add_forests, add_parks, house_colors, tree_colors, store):
+    rows, cols = map_shape
+    type_grid = make_type_grid(map_shape, add_forests, add_parks)
+    block_types = type_grid.ravel()
+    batches = make_item_batches(type_grid, blocksize, house_colors, tree_colors)
+
+    #One block per cell, with the colour and heat value of its type
+    prototypes = [globals()[block_type](blocksize, (0, 0)) for block_type in BLOCK_TYPES]
+    cell_rows, cell_cols = np.divmod(np.arange(rows * cols), cols)
+    cells = [np.arange(rows * cols)] + [batch.cells for batch in batches]
+    ranks = [np.full(rows * cols, -1)] + [batch.ranks for batch in batches]
+    type_codes = [np.array([store.get_type_code(block_type) for block_type in BLOCK_TYPES])[block_types]]
+    pos = [np.stack([blocksize * cell_cols, blocksize * cell_rows], axis=1)]
+    size = [np.full((rows * cols, 2), blocksize)]
+    colours = [np.array([block.get_base_colour() for block in prototypes])[block_types]]
+    heat_vals = [np.array([block.heat_val for block in prototypes], dtype=float)[block_types]]
+    boundaries = [np.zeros(rows * cols, dtype=np.int16)]
+    for batch in batches:
+        type_codes.append(np.full(len(batch), store.get_type_code(batch.prototype.get_type())))
+        pos.append(batch.pos)
+        size.append(np.broadcast_to(batch.prototype.size, (len(batch), 2)))
+        colours.append(batch.colours)
+        heat_vals.append(np.full(len(batch), batch.prototype.heat_val, dtype=float))
+        boundaries.append(np.full(len(batch), getattr(batch.prototype, 'boundary', 0), dtype=np.int16))
+
+    #In order of cell, with the block before its items and the items in rank
+    #order. Ranks have no gaps, so every entity goes straight to its place.
+    cells = np.concatenate(cells)
+    block_starts = np.concatenate([[0], np.cumsum(np.bincount(cells, minlength=rows * cols))[:-1]])
+    order = np.empty(len(cells), dtype=np.int64)
+    order[block_starts[cells] + np.concatenate(ranks) + 1] = np.arange(len(cells))
+    parents = np.full(len(cells), -1, dtype=np.int64)
+    parents[block_starts[cells] + np.concatenate(ranks) + 1] = np.where(np.concatenate(ranks) < 0, -1, block_starts[cells] + store.count)
+    store.extend(np.concatenate(type_codes)[order], np.concatenate(pos)[order], np.concatenate(size)[order],
+                 np.concatenate(colours)[order], np.concatenate(heat_vals)[order], parents, np.concatenate(boundaries)[order])
+    return type_grid
+
+#Setting up the map. With bulk or a store the map is generated from a type
+#grid straight into an EntityStore (a new one for bulk), and the blocks are views of it.
+def make_map(blocksize, rows, cols, add_forests, add_parks, csv_filename='colours.csv', store=None, bulk=False):
     house_colors, tree_colors = csv_read(csv_filename)
     map_shape = (rows, cols)
+
+    if bulk or store is not None:
+        store = store if store is not None else EntityStore()
+        start = store.count
+        generate_map(blocksize, map_shape, add_forests, add_parks, house_colors, tree_colors, store)
+        return BlockGrid.from_blocks(store.get_blocks(start), map_shape, blocksize), map_shape
+
     blocks = place_blocks(map_shape, blocksize)
 
     if add_forests:
@@ -168,7 +451,6 @@ def make_map(blocksize, rows, cols, add_forests, add_parks, csv_filename='colour
     else:
         print("Skipping forest")
 
-    blocks = add_household(blocks, map_shape, blocksize, house_colors, tree_colors)
     blocks, roads = add_roads(blocks, map_shape, blocksize, tree_colors)
     
     if add_parks:
@@ -176,4 +458,165 @@ def make_map(blocksize, rows, cols, add_forests, add_parks, csv_filename='colour
     else:
         print("Skipping Parks")
 
+    #Households go on the ground blocks left after the forest, roads and parks
+    blocks = add_household(blocks, map_shape, blocksize, house_colors, tree_colors)
     return blocks, map_shape
+
+#Groups entities by type into contiguous index arrays, so that per-type
+#updates work on arrays instead of checking get_type() on every entity
+class EntityRegistry:
+    def __init__(self, entities):
+        self.types = BLOCK_TYPES + ITEM_TYPES
+        codes = {entity_type: code for code, entity_type in enumerate(self.types)}
+        self.type_codes = np.zeros(len(entities), dtype=np.int16)
+        for index, entity in enumerate(entities):
+            entity_type = entity.get_type()
+            if entity_type not in codes:
+                codes[entity_type] = len(self.types)
+                self.types.append(entity_type)
+            self.type_codes[index] = codes[entity_type]
+        self.codes = codes
+
+        #Entity indices sorted by type, with the bounds of each type
+        self.order = np.argsort(self.type_codes, kind='stable')
+        self.bounds = np.searchsorted(self.type_codes[self.order], np.arange(len(self.types) + 1))
+
+    #Indices of all entities of a type
+    def get_indices(self, entity_type):
+        if entity_type not in self.codes:
+            return np.zeros(0, dtype=np.int64)
+        code = self.codes[entity_type]
+        return self.order[self.bounds[code]:self.bounds[code + 1]]
+
+    #True for the entities of any of the given types
+    def get_mask(self, entity_types):
+        return np.isin(self.type_codes, [self.codes[t] for t in entity_types if t in self.codes])
+
+    def count(self, entity_type):
+        return len(self.get_indices(entity_type))
+
+#Rasterises the blocks and items of a map into one map-sized label array
+class MapRaster:
+    def __init__(self, blocks, map_shape, blocksize, paint=True):
+        self.map_shape = map_shape
+        self.blocksize = blocksize
+        self.shape = (map_shape[0] * blocksize, map_shape[1] * blocksize)
+        self.entities = []
+        self.blocks = []
+        footprints = []
+
+        #Entities are numbered in painting order, each block followed by its items
+        for block in blocks:
+            cx_start, ry_start = block.get_topleft()
+            self.blocks.append(len(self.entities))
+            self.entities.append(block)
+            footprints.append((ry_start, ry_start + block.size, cx_start, cx_start + block.size))
+            for item in block.items:
+                x, y = item.get_topleft()
+                size = item.get_size()
+                self.entities.append(item)
+                footprints.append((ry_start + y, ry_start + y + size[0], cx_start + x, cx_start + x + size[1]))
+
+        self.blocks = np.array(self.blocks, dtype=np.int64)
+        self.registry = EntityRegistry(self.entities)
+        self.thermal_field = None
+
+        #Heat values of entities kept in one EntityStore are read and written as
+        #one column, unless they are bound to a ThermalField and only there
+        stores = {entity.store for entity in self.entities}
+        self.store = stores.pop() if len(stores) == 1 else None
+        if any(entity.thermal_field is not None for entity in self.entities):
+            self.store = None
+        if self.store is not None:
+            self.store_indices = np.array([entity.index for entity in self.entities], dtype=np.int64)
+        self.footprints = np.array(footprints, dtype=np.int64).reshape(-1, 4)
+        self.footprints[:, :2] = np.clip(self.footprints[:, :2], 0, self.shape[0])
+        self.footprints[:, 2:] = np.clip(self.footprints[:, 2:], 0, self.shape[1])
+
+        #Maps too large to label in memory are painted band by band with get_band_labels
+        self.labels = self.get_band_labels(0, self.shape[0]) if paint else None
+
+    def __len__(self):
+        return len(self.entities)
+
+    #Labels of pixel rows r0 to r1, painting the given entities that cross
+    #the band (by default all that do) in order, so later entities paint over
+    #earlier ones as when the map is drawn block by block
+    def get_band_labels(self, r0, r1, indices=None):
+        if indices is None:
+            indices = np.flatnonzero((self.footprints[:, 0] < r1) & (self.footprints[:, 1] > r0))
+        labels = np.zeros((r1 - r0, self.shape[1]), dtype=np.int32)
+        for index in indices:
+            y0, y1, x0, x1 = self.footprints[index]
+            labels[max(y0, r0) - r0:min(y1, r1) - r0, x0:x1] = index
+        return labels
+
+    #Heat values of all entities as one array
+    def get_heat_vals(self):
+        if self.thermal_field is not None:
+            return self.thermal_field.heat_vals.copy()
+        if self.store is not None:
+            return self.store.heat[self.store_indices]
+        return np.array([entity.get_heat_val() for entity in self.entities], dtype=float)
+
+    #Writes an array of heat values back to the entities
+    def set_heat_vals(self, heat_vals):
+        if self.thermal_field is not None:
+            self.thermal_field.set_heat_vals(heat_vals)
+            return
+        if self.store is not None:
+            self.store.heat[self.store_indices] = heat_vals
+            return
+        for entity, heat_val in zip(self.entities, heat_vals):
+            entity.set_heat_val(heat_val)
+
+    #Mean of a field over every entity footprint, using a summed area table
+    def footprint_means(self, field):
+        table = np.zeros((field.shape[0] + 1, field.shape[1] + 1))
+        table[1:, 1:] = field.cumsum(axis=0).cumsum(axis=1)
+        y0, y1, x0, x1 = self.footprints.T
+        totals = table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+        areas = np.maximum((y1 - y0) * (x1 - x0), 1)
+        return totals / areas
+
+#Version of the map snapshot files written by save_map
+SNAPSHOT_VERSION = 2
+
+#Saves a map to a compact npz snapshot: the type grid, the columns of all its
+#blocks and items in painting order, their palette, and the seed and options
+#it was made with, so it can be loaded again without running make_map
+def save_map(filename, blocks, map_shape, blocksize, seed=None, add_forests=True, add_parks=True):
+    entities = [entity for block in blocks for entity in [block] + list(block.items)]
+    store = entities[0].store if entities else None
+
+    #A store that holds exactly this map, in painting order, is saved as it is.
+    #Heat values of entities bound to a ThermalField are only in the field.
+    if store is None or store.count != len(entities) or any(
+            entity.store is not store or entity.index != index or entity.thermal_field is not None for index, entity in enumerate(entities)):
+        store = EntityStore(max(len(entities), 1))
+        for block in blocks:
+            parent = store.add(block.get_type(), block.get_topleft(), (block.size, block.size), block.get_base_colour(), block.get_heat_val())
+            for item in block.items:
+                store.add(item.get_type(), item.pos, item.size, item.get_base_colour(), item.get_heat_val(), parent, getattr(item, 'boundary', 0))
+
+    grid = blocks if isinstance(blocks, BlockGrid) else BlockGrid.from_blocks(blocks, map_shape, blocksize)
+    store.save(filename, version=SNAPSHOT_VERSION, type_grid=grid.get_type_grid(), map_shape=np.array(map_shape),
+               blocksize=blocksize, seed=-1 if seed is None else seed, add_forests=add_forests, add_parks=add_parks)
+
+#Loads a map saved by save_map. The blocks are views of an EntityStore.
+#Returns the blocks, the map shape and the other settings of the snapshot.
+def load_map(filename):
+    store, arrays = EntityStore.load(filename)
+    if int(arrays['version']) != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported map snapshot version: {int(arrays['version'])}")
+    map_shape = tuple(arrays['map_shape'].tolist())
+    seed = int(arrays['seed'])
+    info = {
+        'blocksize': int(arrays['blocksize']),
+        'seed': None if seed < 0 else seed,
+        'add_forests': bool(arrays['add_forests']),
+        'add_parks': bool(arrays['add_parks']),
+        'type_grid': arrays['type_grid'],
+    }
+    blocks = BlockGrid.from_blocks(store.get_blocks(), map_shape, info['blocksize'])
+    return blocks, map_shape, info
@@ -1,17 +1,73 @@
 import random
 import numpy as np
-import matplotlib.pyplot as plt
 from math import pi, sin
 
+#Names of the block and item types, in the order they are reported
+BLOCK_TYPES = ['Ground', 'Water', 'Forest', 'Road', 'Park']
+ITEM_TYPES = ['Tree', 'House', 'Bushes', 'Street', 'MerryGo', 'Slide', 'Pond', 'White_lines', 'Apartment']
+
+#Attribute that is kept in a column of an EntityStore once the object is
+#added to one, and in the object itself before that
+class StoreAttribute:
+    def __init__(self, column, convert=None):
+        self.column = column
+        self.convert = convert
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, entity, owner=None):
+        if entity is None:
+            return self
+        if entity.store is None:
+            return entity.__dict__[self.name]
+        value = entity.store.get(self.column, entity.index)
+        return self.convert(value) if self.convert else value
+
+    def __set__(self, entity, value):
+        if entity.store is None:
+            entity.__dict__[self.name] = value
+        else:
+            entity.store.set(self.column, entity.index, value)
+
 #Item classes
 class Object:
+    pos = StoreAttribute('pos', lambda pos: tuple(pos.tolist()))
+    size = StoreAttribute('size', lambda size: tuple(size.tolist()))
+    item_colour = StoreAttribute('colour')
+    heat_val = StoreAttribute('heat')
+
     def __init__(self, pos, colour, size, heat_val = 50):
+        self.store = None
+        self.index = None
         self.pos = pos
         self.item_colour = np.array(colour)
-        self.colour = self.item_colour.copy()
+        self.tint = None
         self.size = size
         self.heat_val = heat_val
-        self.image = np.full((self.size[0], self.size[1], 3), self.colour)  
+        self.thermal_field = None
+        self.field_index = None
+        self._image = None
+
+    #Colour after the day and night tint, the base colour until day_night is called
+    @property
+    def colour(self):
+        return self.item_colour if self.tint is None else self.tint
+
+    @colour.setter
+    def colour(self, colour):
+        self.tint = colour
+
+    #The image is drawn when asked for, unless one was set with set_image
+    @property
+    def image(self):
+        if self._image is None:
+            return self.get_image()
+        return self._image
+
+    @image.setter
+    def image(self, image):
+        self._image = image
 
     def get_coord(self):
         return self.pos
@@ -19,14 +75,22 @@ class Object:
     def get_colour(self):
         return self.colour
 
+    #Colour before the day and night tint is applied
+    def get_base_colour(self):
+        return self.item_colour
+
     def set_colour(self, colour):
         self.item_colour = np.array(colour)
-        self.colour = self.item_colour.copy()
-        self.image = np.full((self.size[0], self.size[1], 3), self.colour)  
+        self.tint = None
+        self.image = None
 
     def get_image(self):
         return np.full((self.size[0], self.size[1], 3), self.colour)
 
+    #Pixels of the footprint the object covers, None when it covers all of it
+    def get_mask(self):
+        return None
+
     def set_image(self, image):
         if image.shape[:2] == (self.size[0], self.size[1]):
             self.image = image
@@ -43,18 +107,27 @@ class Object:
 
     def set_size(self, size):
         self.size = size
-        self.image = np.full((self.size[0], self.size[1], 3), self.colour)  
+        self.image = None
 
     def get_heat_val(self):
+        if self.thermal_field is not None:
+            return self.thermal_field.get_heat_val(self.field_index)
         return self.heat_val
     
     def set_heat_val(self, heat_val):
+        if self.thermal_field is not None:
+            self.thermal_field.set_heat_val(self.field_index, heat_val)
         self.heat_val = heat_val
 
+    #Makes the heat value a view into a ThermalField
+    def bind_field(self, thermal_field, index):
+        self.thermal_field = thermal_field
+        self.field_index = index
+
     def day_night(self, factor):
         brightness = np.array([50,30,30])
         self.colour = np.clip(self.item_colour+ brightness*(1-factor), 50, 250).astype(np.uint8)
-        self.image = np.full((self.size[0], self.size[1], 3), self.colour)  
+        self.image = None
 
     def get_type(self):
         return self.__class__.__name__
@@ -67,6 +140,8 @@ class Tree(Object):
         super().__init__(pos, colour, (size, size), heat_val = 70)
 
 class House(Object):
+    boundary = StoreAttribute('boundary', int)
+
     def __init__(self, pos, colour, height, width, boundary):
         super().__init__(pos, colour, (height, width), heat_val = 80)
         self.boundary = boundary
@@ -83,6 +158,8 @@ class House(Object):
         return left <= x <= right and top <= y <= bottom
     
 class Apartment(Object):
+    boundary = StoreAttribute('boundary', int)
+
     def __init__(self, pos, colour, height, width, boundary):
         super().__init__(pos, colour, (height, width), heat_val = 80)
         self.boundary = boundary
@@ -115,20 +192,24 @@ class Bushes(Object):
         super().__init__(pos, colour, (size, size), heat_val = 70)
 
 class MerryGo(Object):
+    corner_colour = np.array([153, 255, 204])
+
     def __init__(self, pos, colour, size):
         super().__init__(pos, colour, (size, size), heat_val = 90)
 
-    def get_image(self):
-        image = np.full((self.size[0], self.size[1], 3), self.colour)
-        
+    def get_mask(self):
         # Creating a circulr shape
         y, x = np.ogrid[:self.size[0], :self.size[1]]
         center = (self.size[0] / 2-0.5, self.size[1] / 2-0.5)
         radius = np.sqrt((x - center[0])**2 + (y - center[1])**2)
-        mask = radius <= min(self.size[0], self.size[1]) // 2
+        return radius <= min(self.size[0], self.size[1]) // 2
+
+    def get_image(self):
+        image = np.full((self.size[0], self.size[1], 3), self.colour)
+        mask = self.get_mask()
         
         #applying to the square.
-        image[~mask] = [153, 255, 204]  
+        image[~mask] = self.corner_colour
         
         return image
     
@@ -141,23 +222,54 @@ class Slide(Object):
 
 #block classes
 class Blocks:
+    size = StoreAttribute('size', lambda size: int(size[0]))
+    topleft = StoreAttribute('pos', lambda pos: tuple(pos.tolist()))
+    bg_colour = StoreAttribute('colour')
+    heat_val = StoreAttribute('heat')
+
     def __init__(self, size, topleft, colour=np.array([255, 255, 255]), heat_val = 50):
+        self.store = None
+        self.index = None
         self.size = size
         self.topleft = topleft
         self.items = []
         self.bg_colour = np.array(colour)
-        self.colour = self.bg_colour.copy()
+        self.tint = None
         self.heat_val = heat_val
+        self.thermal_field = None
+        self.field_index = None
 
     def get_topleft(self):
         return self.topleft
 
     def add_item(self, item):
         self.items.append(item)
+        if self.store is not None and item.store is None:
+            self.store.adopt(item, self.index)
+
+    #Colour after the day and night tint, the base colour until day_night is called
+    @property
+    def colour(self):
+        return self.bg_colour if self.tint is None else self.tint
+
+    @colour.setter
+    def colour(self, colour):
+        self.tint = colour
+
+    def get_colour(self):
+        return self.colour
+
+    #Colour before the day and night tint is applied
+    def get_base_colour(self):
+        return self.bg_colour
+
+    #Blocks always cover their whole footprint
+    def get_mask(self):
+        return None
 
     def set_bg_colour(self, colour):
         self.bg_colour = np.array(colour)
-        self.colour = self.bg_colour.copy()
+        self.tint = None
 
     def generate_image(self):
         grid = np.full((self.size, self.size, 3), self.colour)
@@ -172,11 +284,20 @@ class Blocks:
         return grid
 
     def get_heat_val(self):
+        if self.thermal_field is not None:
+            return self.thermal_field.get_heat_val(self.field_index)
         return self.heat_val
     
     def set_heat_val(self, heat_val):
+        if self.thermal_field is not None:
+            self.thermal_field.set_heat_val(self.field_index, heat_val)
         self.heat_val = heat_val
 
+    #Makes the heat value a view into a ThermalField
+    def bind_field(self, thermal_field, index):
+        self.thermal_field = thermal_field
+        self.field_index = index
+
     def day_night(self, factor):
         brightness = np.array([50,30,30])
         self.colour = np.clip(self.bg_colour + brightness*(1-factor), 50, 255).astype(np.uint8)
@@ -0,0 +1,95 @@
+import queue
+import threading
+import time
+
+#Marks the end of the items passed between stages
+DONE = object()
+
+#Runs a chain of stages over a sequence of items. Threaded, every stage but
+#the last runs in its own thread and hands its results to the next stage
+#through a bounded queue, so stage i works on item t+1 while stage i+1 is
+#still busy with item t. The last stage runs in the calling thread, so it
+#can draw with matplotlib.
+class Pipeline:
+    def __init__(self, stages, queue_size=2):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.timings = {name: 0.0 for name, _ in stages}
+        self.elapsed = 0.0
+        self.items = 0
+        self.error = None
+        self.stopped = threading.Event()
+
+    #Runs one stage function on an item and adds up the time it took
+    def call(self, name, function, item):
+        start = time.perf_counter()
+        result = function(item)
+        self.timings[name] += time.perf_counter() - start
+        return result
+
+    #Puts an item on a queue, giving up if the pipeline was stopped
+    def put(self, target, item):
+        while not self.stopped.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    #Items from a queue until the previous stage is done or the pipeline stopped
+    def receive(self, source):
+        while not self.stopped.is_set():
+            try:
+                item = source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is DONE:
+                return
+            yield item
+
+    def worker(self, name, function, items, target):
+        try:
+            for item in items:
+                self.put(target, self.call(name, function, item))
+        except Exception as e:
+            self.error = e
+            self.stopped.set()
+        self.put(target, DONE)
+
+    def run(self, items, threaded=True):
+        start = time.perf_counter()
+        if not threaded:
+            for item in items:
+                for name, function in self.stages:
+                    item = self.call(name, function, item)
+                self.items += 1
+            self.elapsed += time.perf_counter() - start
+            return
+
+        threads = []
+        for name, function in self.stages[:-1]:
+            target = queue.Queue(maxsize=self.queue_size)
+            thread = threading.Thread(target=self.worker, args=(name, function, items, target), daemon=True)
+            thread.start()
+            threads.append(thread)
+            items = self.receive(target)
+
+        name, function = self.stages[-1]
+        try:
+            for item in items:
+                self.call(name, function, item)
+                self.items += 1
+        finally:
+            if self.error is None and self.stopped.is_set():
+                self.error = RuntimeError("Pipeline stopped")
+            self.stopped.set()
+            for thread in threads:
+                thread.join()
+            self.elapsed += time.perf_counter() - start
+
+        if self.error is not None:
+            raise self.error
+
+    def __str__(self):
+        stages = ", ".join(f"{name} {seconds:.2f} s" for name, seconds in self.timings.items())
+        return f"Pipeline: {self.items} items in {self.elapsed:.2f} s ({stages})"
@@ -0,0 +1,160 @@
+from collections import OrderedDict
+import hashlib
+import numpy as np
+from math import pi, sin
+from object_placement import MapRaster
+
+#Defining colours for flood and snow
+flood_colour = np.array([0,119,190])
+snow_colour = np.array([255,255,255])
+rain_colour = np.array([93,226,231])
+
+#Colour changes made by flooding and snowing, the same as recolouring every
+#block and item as the weather progresses (see recolour_block in test_rendering.py):
+#the weather, the block and item types it changes, the progress that has to
+#be passed and the new colour
+WEATHER_RULES = [
+    ('flood', ['Ground', 'Water', 'Forest', 'Park'], 0.2, flood_colour),
+    ('flood', ['Road'], 0.4, flood_colour),
+    ('flood', ['Pond'], 0.2, flood_colour),
+    ('flood', ['Street', 'White_lines'], 0.5, flood_colour),
+    ('flood', ['MerryGo'], 0.6, flood_colour),
+    ('flood', ['Bushes'], 0.8, flood_colour),
+    ('snow', ['Ground', 'Forest', 'Park'], 0.2, snow_colour),
+    ('snow', ['Road'], 0.4, snow_colour),
+    ('snow', ['Street', 'White_lines'], 0.5, snow_colour),
+    ('snow', ['MerryGo'], 0.6, snow_colour),
+    ('snow', ['Bushes'], 0.8, snow_colour),
+]
+
+#Digest of the bytes of some arrays, the same in every process
+def get_digest(*arrays):
+    digest = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+#Least recently used cache of rendered frames with a cap on the total bytes
+class FrameCache:
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self.frames = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        frame = self.frames.get(key)
+        if frame is None:
+            self.misses += 1
+            return None
+        self.frames.move_to_end(key)
+        self.hits += 1
+        return frame
+
+    def put(self, key, frame):
+        if frame.nbytes > self.max_bytes or key in self.frames:
+            return
+
+        #Cached frames are shared, so they are made read-only
+        frame.flags.writeable = False
+        self.frames[key] = frame
+        self.nbytes += frame.nbytes
+        while self.nbytes > self.max_bytes:
+            _, old = self.frames.popitem(last=False)
+            self.nbytes -= old.nbytes
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __str__(self):
+        return f"FrameCache: {len(self)} frames, {self.nbytes} bytes, hits = {self.hits}, misses = {self.misses}"
+
+#Renders the map from an entity ID raster that is built once with the map
+class MapRenderer:
+    brightness = np.array([50,30,30])
+
+    def __init__(self, blocks, map_shape, blocksize=25, raster=None, frame_cache=None):
+        self.frame_cache = frame_cache
+        self.raster = raster if raster is not None else MapRaster(blocks, map_shape, blocksize)
+        self.entities = self.raster.entities
+
+        #Pixels that keep a fixed colour, like the corners around a merry-go-round,
+        #get palette entries after the entities, one for every masked entity
+        self.masks = {}
+        for index, entity in enumerate(self.entities):
+            mask = entity.get_mask()
+            if mask is not None:
+                self.masks[index] = (len(self.entities) + len(self.masks), mask)
+        self.masked = np.array(list(self.masks), dtype=np.int64)
+        self.fixed_colours = np.array([self.entities[index].corner_colour for index in self.masks], dtype=np.uint8).reshape(-1, 3)
+
+        #Rasters without labels are rendered band by band from their ids
+        self.ids = self.get_ids(self.raster.labels) if self.raster.labels is not None else None
+
+        #Items are tinted up to 250 and blocks up to 255, as in their day_night methods
+        self.clip_high = np.full((len(self.entities), 1), 250)
+        self.clip_high[self.raster.blocks] = 255
+        self.base_colours = self.get_base_colours()
+        self.palettes = {}
+
+        #A frame is decided by the layout of the map, its base colours and the
+        #hour, so cached frames are keyed by digests of the first two. Renderers
+        #of the same map in the same weather share frames, in any process.
+        masks = [mask for _, mask in self.masks.values()]
+        self.map_key = get_digest(np.array(self.raster.shape), self.raster.footprints, self.masked, self.fixed_colours, self.clip_high, *masks)
+        self.colour_key = get_digest(self.base_colours)
+
+        #Counts the weather changes to the base colours
+        self.stage = 0
+
+    #Palette ids of a band of labels starting at pixel row r0: the labels,
+    #with the fixed colour pixels of masked entities pointing past them
+    def get_ids(self, labels, r0=0):
+        ids = labels.copy()
+        r1 = r0 + len(labels)
+        rows = self.raster.footprints[self.masked, :2]
+        for index in self.masked[(rows[:, 0] < r1) & (rows[:, 1] > r0)]:
+            fixed_id, mask = self.masks[index]
+            y0, y1, x0, x1 = self.raster.footprints[index]
+            top, bottom = max(y0, r0), min(y1, r1)
+            region = ids[top - r0:bottom - r0, x0:x1]
+            corners = ~mask[top - y0:bottom - y0, :x1 - x0] & (region == index)
+            region[corners] = fixed_id
+        return ids
+
+    #Untinted colours of all entities
+    def get_base_colours(self):
+        return np.array([entity.get_base_colour() for entity in self.entities]).reshape(-1, 3)
+
+    #Tinted palette for an hour of the day. Palettes are kept until the
+    #base colours change, so a day needs at most 24 of them.
+    def get_palette(self, hour):
+        if hour not in self.palettes:
+            time_factor = 0.1 - 0.9 * sin((2 * pi / 24) * (hour - 6))
+            tinted = self.base_colours + self.brightness * (1 - time_factor)
+            colours = np.clip(tinted, 50, self.clip_high).astype(np.uint8)
+            self.palettes[hour] = np.concatenate([colours, self.fixed_colours])
+        return self.palettes[hour]
+
+    #Same picture as drawing every block with its items, as a uint8 array drawn with one palette lookup
+    def generate_image(self, hour):
+        if self.frame_cache is None:
+            return self.get_palette(hour)[self.ids]
+
+        key = (self.map_key, self.colour_key, hour)
+        grid = self.frame_cache.get(key)
+        if grid is None:
+            grid = self.get_palette(hour)[self.ids]
+            self.frame_cache.put(key, grid)
+        return grid
+
+    #Applies weather colour changes from WEATHER_RULES to every entity of their types at once
+    def apply_weather(self, rules):
+        if not rules:
+            return
+        for kind, types, threshold, colour in rules:
+            self.base_colours[self.raster.registry.get_mask(types)] = colour
+        self.palettes = {}
+        self.colour_key = get_digest(self.base_colours)
+        self.stage += 1
@@ -0,0 +1,134 @@
+import os
+import io
+import json
+import time
+import random
+import argparse
+import itertools
+import contextlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from object_placement import make_map
+from temperature_stats import TemperatureStats, HISTORY_DTYPE
+from objects import BLOCK_TYPES, ITEM_TYPES
+from map import run_simulation, get_scenario_config
+
+#History of a sweep, the history of every job tagged with its job number
+SWEEP_DTYPE = np.dtype([('job', np.int32)] + HISTORY_DTYPE.descr)
+
+#Seed of a repeat of the sweep. Every configuration of the same repeat gets
+#the same seed, so configurations are compared on the same random numbers.
+def get_seed(base_seed, repeat):
+    return int(np.random.SeedSequence([base_seed, repeat]).generate_state(1)[0])
+
+#One job for every combination of the scenarios, options and repeats.
+#options maps config keys to the list of values to sweep over. stop_rain
+#only changes flood scenarios, so it is not swept for the others.
+def make_jobs(scenarios, options, repeats=1, base_seed=0, engine='vectorized'):
+    jobs = []
+    for scenario in scenarios:
+        flood = get_scenario_config(scenario)['flood']
+        keys = [key for key in options if key != 'stop_rain' or flood]
+        for values in itertools.product(*(options[key] for key in keys)):
+            for repeat in range(repeats):
+                config = get_scenario_config(scenario)
+                config.update(zip(keys, values))
+                config.update({'scenario': scenario, 'repeat': repeat, 'seed': get_seed(base_seed, repeat), 'engine': engine})
+                jobs.append(config)
+    return jobs
+
+#Builds the map of a job and simulates it headless, in a worker process
+def run_job(config):
+    random.seed(config['seed'])
+    np.random.seed(config['seed'])
+
+    start_time = time.perf_counter()
+    stats = TemperatureStats(config['num_days'] * 24, BLOCK_TYPES + ITEM_TYPES)
+
+    #The per-hour output of the simulation is dropped
+    with contextlib.redirect_stdout(io.StringIO()):
+        blocks, map_shape = make_map(config['blocksize'], config['rows'], config['cols'], config['add_forests'], config['add_parks'])
+        real_temperatures, depicted_temperatures, _, _ = run_simulation(
+            blocks, map_shape, config['num_days'], config['flood'], config['stop_rain'], config['snow'],
+            config['blocksize'], engine=config['engine'], stats=stats, headless=True)
+    return {
+        'real_temperatures': np.array(real_temperatures),
+        'depicted_temperatures': np.array(depicted_temperatures),
+        'history': stats.to_array(),
+        'elapsed': time.perf_counter() - start_time,
+    }
+
+#Runs every job over a process pool, returning the results in job order
+def run_sweep(jobs, workers=None):
+    results = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_job, config): job for job, config in enumerate(jobs)}
+        for done, future in enumerate(as_completed(futures), 1):
+            job = futures[future]
+            results[job] = future.result()
+            config = jobs[job]
+            print(f"[{done}/{len(jobs)}] Job {job}: {config['scenario']} {config['rows']}x{config['cols']}, "
+                  f"stop_rain {config['stop_rain']}, seed {config['seed']} ({results[job]['elapsed']:.2f} s)")
+    return results
+
+#Saves all the jobs to one file. Temperatures are padded with NaN to the longest job.
+def save_sweep(filename, jobs, results):
+    hours = np.array([len(result['real_temperatures']) for result in results])
+    real_temperatures = np.full((len(jobs), hours.max(initial=0)), np.nan)
+    depicted_temperatures = np.full_like(real_temperatures, np.nan)
+    histories = []
+    for job, result in enumerate(results):
+        real_temperatures[job, :hours[job]] = result['real_temperatures']
+        depicted_temperatures[job, :hours[job]] = result['depicted_temperatures']
+        history = np.zeros(len(result['history']), dtype=SWEEP_DTYPE)
+        history['job'] = job
+        for name in HISTORY_DTYPE.names:
+            history[name] = result['history'][name]
+        histories.append(history)
+
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    np.savez(filename,
+             configs=np.array([json.dumps(config) for config in jobs]),
+             hours=hours,
+             real_temperatures=real_temperatures,
+             depicted_temperatures=depicted_temperatures,
+             history=np.concatenate(histories) if histories else np.zeros(0, dtype=SWEEP_DTYPE))
+    print(f"Sweep results saved to {filename}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a grid of headless map simulations over a process pool.")
+    parser.add_argument('--scenarios', nargs='+', choices=['snow', 'rain', 'normal'], default=['snow', 'rain', 'normal'], help="Scenarios to run")
+    parser.add_argument('--rows', type=int, nargs='+', help="No. of block rows to sweep over")
+    parser.add_argument('--cols', type=int, nargs='+', help="No. of block columns to sweep over")
+    parser.add_argument('--days', type=int, nargs='+', help="No. of days to sweep over")
+    parser.add_argument('--stop-rain', type=int, nargs='+', help="Hours before the rain stops to sweep over")
+    parser.add_argument('--repeats', type=int, default=1, help="Runs of every configuration, each with its own seed")
+    parser.add_argument('--seed', type=int, default=0, help="Seed the seed of every repeat is derived from")
+    parser.add_argument('--engine', choices=['loop', 'vectorized', 'global', 'field'], default='vectorized', help="Heat diffusion engine")
+    parser.add_argument('--workers', type=int, help="No. of worker processes (default: one per CPU)")
+    parser.add_argument('--output', default='sweep.npz', help="File to save the results of all jobs to")
+    args = parser.parse_args()
+
+    options = {key: values for key, values in [('rows', args.rows), ('cols', args.cols), ('num_days', args.days), ('stop_rain', args.stop_rain)] if values}
+    if any(value <= 0 for key in ['rows', 'cols', 'num_days'] for value in options.get(key, [])):
+        parser.error("--rows, --cols and --days must be positive")
+    if args.repeats <= 0:
+        parser.error("--repeats must be positive")
+    if any(value < 0 for value in options.get('stop_rain', [])):
+        parser.error("--stop-rain can not be negative")
+    if 'stop_rain' in options and 'rain' not in args.scenarios:
+        parser.error("--stop-rain only applies to the rain scenario")
+
+    #Same limits as map.py, checked before any job reaches a worker
+    jobs = make_jobs(args.scenarios, options, args.repeats, args.seed, args.engine)
+    for config in jobs:
+        if config['rows'] * config['cols'] < 12:
+            parser.error(f"the map needs at least 12 blocks, {config['rows']}x{config['cols']} has {config['rows'] * config['cols']}")
+    print(f"Running {len(jobs)} jobs")
+    start_time = time.perf_counter()
+    results = run_sweep(jobs, args.workers)
+    print(f"Finished {len(jobs)} jobs in {time.perf_counter() - start_time:.2f} s")
+    save_sweep(args.output, jobs, results)
+
+if __name__ == "__main__":
+    main()
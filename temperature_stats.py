@@ -0,0 +1,91 @@
+import numpy as np
+
+#Fields of the exported history, one row per timestep, realisation and type
+HISTORY_DTYPE = np.dtype([
+    ('step', np.int32),
+    ('realisation', np.int32),
+    ('type', 'U16'),
+    ('count', np.int64),
+    ('mean', np.float64),
+    ('min', np.float64),
+    ('max', np.float64),
+    ('variance', np.float64),
+])
+
+#Per-type temperature statistics for every timestep of a simulation, kept in
+#preallocated arrays and computed with grouped reductions over type codes.
+#An ensemble keeps them for each of its realisations.
+class TemperatureStats:
+    def __init__(self, num_steps, types, realisations=1):
+        self.types = list(types)
+        self.realisations = realisations
+        shape = (num_steps, realisations, len(self.types))
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.mean = np.full(shape, np.nan)
+        self.minimum = np.full(shape, np.nan)
+        self.maximum = np.full(shape, np.nan)
+        self.variance = np.full(shape, np.nan)
+        self.steps = 0
+
+    #Adds the temperatures of all entities for one timestep, with type_codes
+    #giving the index in self.types of every entity, and realisations the
+    #realisation every entity belongs to in an ensemble
+    def add(self, step, temperatures, type_codes, realisations=None):
+        num_types = len(self.types)
+        num_groups = self.realisations * num_types
+        groups = type_codes.astype(np.int64)
+        if realisations is not None:
+            groups = groups + realisations * num_types
+        count = np.bincount(groups, minlength=num_groups)[:num_groups]
+        total = np.bincount(groups, weights=temperatures, minlength=num_groups)[:num_groups]
+        present = count > 0
+
+        #Types without entities keep NaN instead of averaging an empty list
+        mean = np.full(num_groups, np.nan)
+        mean[present] = total[present] / count[present]
+        deviation = (temperatures - mean[groups]) ** 2
+        squares = np.bincount(groups, weights=deviation, minlength=num_groups)[:num_groups]
+        variance = np.full(num_groups, np.nan)
+        variance[present] = squares[present] / count[present]
+
+        minimum = np.full(num_groups, np.inf)
+        maximum = np.full(num_groups, -np.inf)
+        np.minimum.at(minimum, groups, temperatures)
+        np.maximum.at(maximum, groups, temperatures)
+
+        shape = (self.realisations, num_types)
+        self.count[step] = count.reshape(shape)
+        self.mean[step] = mean.reshape(shape)
+        self.variance[step] = variance.reshape(shape)
+        self.minimum[step] = np.where(present, minimum, np.nan).reshape(shape)
+        self.maximum[step] = np.where(present, maximum, np.nan).reshape(shape)
+        self.steps = max(self.steps, step + 1)
+
+    #Mean temperature of each of the given types over the recorded timesteps,
+    #averaged over the realisations that have the type
+    def get_history(self, types):
+        history = {}
+        for entity_type in types:
+            means = self.mean[:self.steps, :, self.types.index(entity_type)]
+            present = ~np.isnan(means)
+            totals = np.where(present, means, 0).sum(axis=1)
+            counts = present.sum(axis=1)
+            history[entity_type] = np.divide(totals, counts, out=np.full(len(totals), np.nan), where=counts > 0).tolist()
+        return history
+
+    #The whole history as one structured array
+    def to_array(self):
+        steps, realisations, num_types = self.steps, self.realisations, len(self.types)
+        history = np.zeros(steps * realisations * num_types, dtype=HISTORY_DTYPE)
+        history['step'] = np.repeat(np.arange(steps), realisations * num_types)
+        history['realisation'] = np.tile(np.repeat(np.arange(realisations), num_types), steps)
+        history['type'] = np.tile(self.types, steps * realisations)
+        history['count'] = self.count[:steps].ravel()
+        history['mean'] = self.mean[:steps].ravel()
+        history['min'] = self.minimum[:steps].ravel()
+        history['max'] = self.maximum[:steps].ravel()
+        history['variance'] = self.variance[:steps].ravel()
+        return history
+
+    def save(self, filename):
+        np.save(filename, self.to_array())
@@ -0,0 +1,57 @@
+import random
+import numpy as np
+import pytest
+from object_placement import make_map, MapRaster
+from entity_store import EntityStore
+from rendering import MapRenderer, snow_colour
+from canvas import MapCanvas
+from map import get_scenario_config, WeatherSchedule, thermal_equation_vectorized, apply_snow, generate_snow
+
+#Seeded map with parks and their merry-go-rounds, built from objects or in bulk into a store
+def make_park_map(bulk, seed=0):
+    random.seed(seed)
+    np.random.seed(seed)
+    config = get_scenario_config('snow')
+    store = EntityStore() if bulk else None
+    blocks, map_shape = make_map(config['blocksize'], 9, 10, True, True, store=store, bulk=bulk)
+    return blocks, map_shape, config
+
+#The canvas draws, band by band, the frames and thermal maps the in-memory
+#renderer and labels give, through the weather of a whole run
+@pytest.mark.parametrize('bulk', [False, True])
+@pytest.mark.parametrize('band_rows', [1, 7, 25, 64, 10000])
+def test_canvas_matches_in_memory_renderer(bulk, band_rows, tmp_path):
+    blocks, map_shape, config = make_park_map(bulk)
+    blocksize = config['blocksize']
+    raster = MapRaster(blocks, map_shape, blocksize)
+    renderer = MapRenderer(blocks, map_shape, blocksize, raster)
+    canvas_raster = MapRaster(blocks, map_shape, blocksize, paint=False)
+    canvas = MapCanvas(tmp_path, MapRenderer(blocks, map_shape, blocksize, canvas_raster), band_rows)
+    assert 'MerryGo' in [entity.get_type() for entity in raster.entities]
+    assert len(canvas) == -(-raster.shape[0] // band_rows)
+    assert np.array_equal(canvas.ids, renderer.ids)
+
+    total_hours = config['num_days'] * 24
+    schedule = WeatherSchedule(total_hours, config['flood'], config['stop_rain'], config['snow'])
+    for hour in range(total_hours):
+        assert np.array_equal(canvas.render(hour % 24), renderer.generate_image(hour % 24))
+
+        temperatures = thermal_equation_vectorized(raster.get_heat_vals(), hour % 24, 0.3)
+        depicted_temp = canvas.render_thermal(temperatures)
+        expected = temperatures[raster.labels]
+        assert np.array_equal(canvas.thermal, expected.astype(np.float32))
+        assert depicted_temp == pytest.approx(np.mean(expected), rel=1e-6)
+
+        #The overlay takes the same random pixels as apply_snow on a whole frame
+        if hour % 6 == 0:
+            np.random.seed(hour)
+            canopy_map = canvas.render(hour % 24, snow_colour, 0.3)
+            np.random.seed(hour)
+            expected = renderer.generate_image(hour % 24)
+            assert np.array_equal(canopy_map, apply_snow(expected, generate_snow(expected.shape[:2], 0.3)))
+
+        canvas.renderer.apply_weather(schedule.get_events(hour))
+        renderer.apply_weather(schedule.get_events(hour))
+    assert renderer.stage > 0
+    canvas.flush()
+    assert np.array_equal(np.load(tmp_path / 'canopy.npy'), canvas.canopy)
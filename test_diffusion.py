@@ -0,0 +1,29 @@
+import copy
+import random
+import numpy as np
+import pytest
+from object_placement import make_map
+from diffusion import heat_diffusion_vectorized
+from map import heat_diffusion, get_scenario_config
+
+#Heat values of every block followed by its items
+def get_heat_vals(blocks):
+    heat_vals = []
+    for block in blocks:
+        heat_vals.append(block.get_heat_val())
+        heat_vals += [item.get_heat_val() for item in block.items]
+    return heat_vals
+
+#The vectorized engine gives exactly the same heat values as heat_diffusion on the preset maps
+@pytest.mark.parametrize('scenario', ['snow', 'rain', 'normal'])
+def test_vectorized_matches_heat_diffusion(scenario):
+    random.seed(0)
+    np.random.seed(0)
+    config = get_scenario_config(scenario)
+    blocks, _ = make_map(config['blocksize'], config['rows'], config['cols'], config['add_forests'], config['add_parks'])
+    expected = copy.deepcopy(blocks)
+
+    for _ in range(3):
+        heat_diffusion(expected)
+        heat_diffusion_vectorized(blocks)
+        assert get_heat_vals(blocks) == get_heat_vals(expected)
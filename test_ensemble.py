@@ -0,0 +1,37 @@
+import io
+import random
+import contextlib
+import numpy as np
+import pytest
+from object_placement import make_map
+from objects import BLOCK_TYPES, ITEM_TYPES
+from temperature_stats import TemperatureStats
+from ensemble import make_ensemble, run_ensemble
+from map import run_simulation, get_scenario_config
+
+#Every realisation of an ensemble follows the run of its map alone with the global engine
+@pytest.mark.parametrize('scenario', ['snow', 'rain'])
+def test_ensemble_matches_run_simulation(scenario):
+    config = get_scenario_config(scenario)
+    config.update({'rows': 5, 'cols': 6, 'num_days': 1})
+    size, seed = 3, 7
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        ensemble = make_ensemble(size, config['blocksize'], config['rows'], config['cols'], config['add_forests'], config['add_parks'], seed)
+        real_temperatures, depicted_temperatures, stats = run_ensemble(
+            ensemble, config['num_days'], config['flood'], config['stop_rain'], config['snow'])
+
+    for realisation, realisation_seed in enumerate(np.random.SeedSequence(seed).generate_state(size)):
+        random.seed(int(realisation_seed))
+        np.random.seed(int(realisation_seed))
+        single_stats = TemperatureStats(config['num_days'] * 24, BLOCK_TYPES + ITEM_TYPES)
+        with contextlib.redirect_stdout(io.StringIO()):
+            blocks, map_shape = make_map(config['blocksize'], config['rows'], config['cols'], config['add_forests'], config['add_parks'])
+            expected_real, expected_depicted, _, _ = run_simulation(
+                blocks, map_shape, config['num_days'], config['flood'], config['stop_rain'], config['snow'],
+                config['blocksize'], engine='global', stats=single_stats, headless=True)
+
+        assert real_temperatures == expected_real
+        assert np.allclose(depicted_temperatures[:, realisation], expected_depicted, rtol=0, atol=1e-9)
+        assert np.array_equal(stats.mean[:, realisation], single_stats.mean[:, 0], equal_nan=True)
+        assert np.array_equal(stats.count[:, realisation], single_stats.count[:, 0])
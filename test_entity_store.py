@@ -0,0 +1,29 @@
+import numpy as np
+from entity_store import EntityStore, COLUMNS
+
+#Saving and loading a store gives back its columns, palette, types and extra arrays
+def test_store_save_load_round_trip(tmp_path):
+    store = EntityStore(capacity=2)
+    block = store.add('Ground', (25, 0), (25, 25), np.array([1, 2, 3]), 21.5)
+    store.add('House', (3, 4), (10, 8), np.array([154, 200, 53]), 80, block, boundary=5)
+    store.add('Tree', (12, 9), (5, 5), np.array([1, 2, 3]), 60, block)
+    store.add('Lake', (0, 0), (25, 25), np.array([0, 0, 255]), 10.25)
+
+    store.save(tmp_path / 'store.npz', version=7, grid=np.arange(6).reshape(2, 3))
+    loaded, arrays = EntityStore.load(tmp_path / 'store.npz')
+
+    assert len(loaded) == len(store) == 4
+    for name in COLUMNS:
+        column = getattr(loaded, name)[:loaded.count]
+        assert column.dtype == getattr(store, name).dtype
+        assert np.array_equal(column, getattr(store, name)[:store.count])
+    assert np.array_equal(loaded.palette, store.palette)
+    assert loaded.types == store.types and loaded.types[-1] == 'Lake'
+    assert set(arrays) == {'version', 'grid'}
+    assert int(arrays['version']) == 7 and np.array_equal(arrays['grid'], np.arange(6).reshape(2, 3))
+
+    #The palette and types keep growing from where they were saved
+    assert loaded.get_colour_index(np.array([1, 2, 3])) == 0
+    assert loaded.get_type_code('Lake') == store.type_codes['Lake']
+    assert loaded.add('Tree', (0, 0), (5, 5), np.array([9, 9, 9]), 60) == 4
+    assert len(loaded.palette) == len(store.palette) + 1
@@ -0,0 +1,139 @@
+import random
+import numpy as np
+import pytest
+from object_placement import make_map, save_map, load_map, OccupancyGrid, BlockGrid, MapRaster
+from diffusion import ThermalField
+from entity_store import EntityStore
+
+#Cells of a block covered by an item, grown by a margin on every side
+def get_cover(item, blocksize, margin=0):
+    x, y = item.get_topleft()
+    height, width = item.get_size()
+    cover = np.zeros((blocksize, blocksize), dtype=bool)
+    cover[max(y - margin, 0):y + height + margin, max(x - margin, 0):x + width + margin] = True
+    return cover
+
+#Every placed corner was free and the item covers it once placed, until no block has room left
+def test_occupancy_grid_places_on_free_cells():
+    np.random.seed(0)
+    grid = OccupancyGrid(50, 25)
+    grid.occupy(np.arange(50), np.full(50, 8), np.full(50, 8), 8, 8, margin=2)
+    placed = [None]
+    while len(placed):
+        free = grid.get_free(3)
+        placed, x, y = grid.place(3)
+        assert free[placed, y, x].all()
+        for dy in range(3):
+            for dx in range(3):
+                assert grid.occupied[placed, y + dy, x + dx].all()
+    assert not grid.get_free(3).any()
+
+#Trees and bushes of a household keep clear of its building's boundary and of each other
+@pytest.mark.parametrize('bulk', [False, True])
+def test_households_do_not_overlap(bulk):
+    random.seed(1)
+    np.random.seed(1)
+    blocks, _ = make_map(25, 12, 12, True, True, bulk=bulk)
+
+    households = 0
+    for block in blocks:
+        buildings = [item for item in block.items if item.get_type() in ['House', 'Apartment']]
+        if not buildings:
+            continue
+        households += 1
+        building, = buildings
+        taken = get_cover(building, block.size, building.boundary)
+        for item in block.items:
+            if item is building:
+                continue
+            x, y = item.get_topleft()
+            height, width = item.get_size()
+            assert 0 <= x and x + width <= block.size and 0 <= y and y + height <= block.size
+            cover = get_cover(item, block.size)
+            assert not (taken & cover).any()
+            taken |= cover
+    assert households > 0
+
+#A map generated in bulk has the block types of one built object by object
+@pytest.mark.parametrize('rows, cols', [(12, 12), (7, 16), (1, 12), (12, 1), (1, 1)])
+@pytest.mark.parametrize('add_forests, add_parks', [(True, True), (False, False)])
+def test_bulk_type_grid_matches_objects(rows, cols, add_forests, add_parks):
+    random.seed(2)
+    np.random.seed(2)
+    blocks, _ = make_map(25, rows, cols, add_forests, add_parks)
+    bulk_blocks, _ = make_map(25, rows, cols, add_forests, add_parks, bulk=True)
+    assert np.array_equal(bulk_blocks.get_type_grid(), blocks.get_type_grid())
+    assert [block.get_type() for block in bulk_blocks] == [block.get_type() for block in blocks]
+
+#Households of store-backed and loaded maps keep their boundary, so
+#boundry_setting tells the cells around their building as it does for objects
+@pytest.mark.parametrize('source', ['objects', 'bulk', 'store', 'loaded'])
+def test_boundary_of_store_backed_households(source, tmp_path):
+    random.seed(3)
+    np.random.seed(3)
+    blocks, map_shape = make_map(25, 12, 12, True, True, bulk=source == 'bulk', store=EntityStore() if source == 'store' else None)
+    if source == 'loaded':
+        save_map(tmp_path / 'map.npz', blocks, map_shape, 25)
+        blocks, _, _ = load_map(tmp_path / 'map.npz')
+
+    buildings = [item for block in blocks for item in block.items if item.get_type() in ['House', 'Apartment']]
+    assert buildings
+    for building in buildings:
+        assert building.boundary == {'House': 5, 'Apartment': 6}[building.get_type()]
+        x, y = building.pos
+        height, width = building.size
+        assert building.boundry_setting(x - building.boundary, y + height + building.boundary)
+        assert not building.boundry_setting(x + width + building.boundary + 1, y)
+
+#Neighbour queries of a block grid give the cells of the 4 or 8-neighbourhood
+#worked out cell by cell, on square, non-square and single row or column maps
+@pytest.mark.parametrize('map_shape', [(5, 5), (3, 7), (7, 3), (1, 6), (6, 1), (1, 1)])
+@pytest.mark.parametrize('diagonal', [False, True])
+def test_neighbours_match_brute_force(map_shape, diagonal):
+    rows, cols = map_shape
+    grid = BlockGrid.from_blocks(make_map(25, rows, cols, True, True, bulk=True)[0], map_shape, 25)
+    table = grid.get_neighbour_table(diagonal)
+    assert table.shape == (rows * cols, 8 if diagonal else 4)
+
+    for row in range(rows):
+        for col in range(cols):
+            expected = [(r, c) for r in range(row - 1, row + 2) for c in range(col - 1, col + 2)
+                        if 0 <= r < rows and 0 <= c < cols and (r, c) != (row, col) and (diagonal or r == row or c == col)]
+            neighbours = table[row * cols + col]
+            assert sorted(divmod(int(cell), cols) for cell in neighbours[neighbours >= 0]) == sorted(expected)
+            assert sorted(map(grid.get_cell, grid.get_neighbours(row, col, diagonal))) == sorted(expected)
+
+#A loaded snapshot has the blocks, items, colours, heat values and settings of
+#the map that was saved, whether it was built from objects, in bulk or has
+#its heat values in a ThermalField
+@pytest.mark.parametrize('source', ['objects', 'bulk', 'field'])
+def test_snapshot_round_trip(source, tmp_path):
+    random.seed(4)
+    np.random.seed(4)
+    blocks, map_shape = make_map(25, 8, 9, True, True, bulk=source != 'objects')
+    if source == 'field':
+        ThermalField(blocks, map_shape, 25).step(0.1, 2)
+    else:
+        for block in blocks:
+            block.set_heat_val(block.get_heat_val() + 0.5)
+
+    save_map(tmp_path / 'map.npz', blocks, map_shape, 25, seed=4, add_forests=True, add_parks=False)
+    loaded, loaded_shape, info = load_map(tmp_path / 'map.npz')
+
+    assert loaded_shape == map_shape
+    assert {key: info[key] for key in ['blocksize', 'seed', 'add_forests', 'add_parks']} == {
+        'blocksize': 25, 'seed': 4, 'add_forests': True, 'add_parks': False}
+    assert np.array_equal(info['type_grid'], BlockGrid.from_blocks(blocks, map_shape, 25).get_type_grid())
+    assert np.array_equal(loaded.get_type_grid(), info['type_grid'])
+
+    entities = [entity for block in blocks for entity in [block] + list(block.items)]
+    loaded_entities = [entity for block in loaded for entity in [block] + list(block.items)]
+    assert [entity.get_type() for entity in loaded_entities] == [entity.get_type() for entity in entities]
+    assert np.array_equal([entity.get_base_colour() for entity in loaded_entities], [entity.get_base_colour() for entity in entities])
+    assert [entity.get_heat_val() for entity in loaded_entities] == [entity.get_heat_val() for entity in entities]
+
+    raster = MapRaster(blocks, map_shape, 25)
+    loaded_raster = MapRaster(loaded, map_shape, 25)
+    assert np.array_equal(loaded_raster.footprints, raster.footprints)
+    assert np.array_equal(loaded_raster.labels, raster.labels)
+    assert np.array_equal(loaded_raster.get_heat_vals(), raster.get_heat_vals())
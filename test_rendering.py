@@ -0,0 +1,202 @@
+import copy
+import random
+import numpy as np
+import pytest
+from math import pi, sin
+from object_placement import make_map, MapRaster
+from objects import BLOCK_TYPES, ITEM_TYPES
+from rendering import MapRenderer, FrameCache, WEATHER_RULES, flood_colour, snow_colour
+from map import get_scenario_config, WeatherSchedule, thermal_equation_vectorized
+
+#The original per-block drawing of the canopy and thermal maps, kept as the
+#reference the renderer and the thermal rasterisation are tested against
+
+#Changes the colours of a block and its items as flooding and snowing progress
+def recolour_block(block, flood_progress, snow_progress):
+    #Handles flooding
+    if flood_progress > 0:
+        
+        #Flooding blocks
+        if block.get_type() in ['Ground', 'Water', 'Forest', 'Park'] and flood_progress > 0.2:
+            block.set_bg_colour(flood_colour)  
+        elif block.get_type() == 'Road' and flood_progress > 0.4:
+            block.set_bg_colour(flood_colour)
+
+        #Flooding items
+        for item in block.items:
+            item_type = item.get_type()
+            if item_type in ['Pond'] and flood_progress > 0.2:
+                item.set_colour(flood_colour)
+            elif item_type in ['Street', 'White_lines'] and flood_progress > 0.5:
+                item.set_colour(flood_colour)
+            elif item_type in ['MerryGo'] and flood_progress > 0.6:
+                item.set_colour(flood_colour)
+            elif item_type == 'Bushes' and flood_progress > 0.8:
+                item.set_colour(flood_colour)
+            
+    #Handles snowing
+    if snow_progress > 0:
+        # Snow covers blocks
+        if block.get_type() in ['Ground', 'Forest', 'Park'] and snow_progress > 0.2:
+            block.set_bg_colour(snow_colour)  
+        elif block.get_type() == 'Road' and snow_progress > 0.4:
+            block.set_bg_colour(snow_colour)
+
+        #snow covers items
+        for item in block.items:
+            item_type = item.get_type()
+            if item_type in ['Street', 'White_lines'] and snow_progress > 0.5:
+                item.set_colour(snow_colour)
+            elif item_type in ['MerryGo'] and snow_progress > 0.6:
+                item.set_colour(snow_colour)
+            elif item_type == 'Bushes' and snow_progress > 0.8:
+                item.set_colour(snow_colour)
+
+#Genertes the image of the map
+def generate_image(blocks, blocksize, map_shape, hour, flood_progress, snow_progress):
+    
+    #Calculate time factor based on hour of the day for day and night simulation
+    time_factor = 0.1 - 0.9 * sin((2 * pi / 24) * (hour - 6))
+    
+    grid = np.zeros((map_shape[0]*blocksize, map_shape[1]*blocksize, 3))
+    
+    for block in blocks:
+        #Adjusting block brighness based on the time of the day
+        block.day_night(time_factor)
+        cx_start, ry_start = block.get_topleft()
+        block_image = block.generate_image()
+        
+        #Handles flooding and snowing
+        recolour_block(block, flood_progress, snow_progress)
+
+        grid[ry_start:ry_start+blocksize, cx_start:cx_start+blocksize] = block_image
+    return grid
+
+
+#Equation to calculate block and item heat changing over time
+def thermal_equation(heat_val, hour, flood_level=0, snow_level=0):
+    heat = heat_val + 15 * np.sin((2 * np.pi / 24) * (hour - 7))  
+    cooldown = 10 * np.sin((2 * np.pi / 24) * (hour - 19))  
+    temperature = heat - cooldown
+    
+    #Applying a cooling affect for flooding
+    flood_cooling = 20 * flood_level  
+    return max(0, temperature - flood_cooling)  
+
+
+#Generates the thermal image of the map.
+def generate_thermal_image(blocks, blocksize, map_shape, hour, flood_level=0, snow_level = 0):
+
+    thermal_grid = np.zeros((map_shape[0]*blocksize, map_shape[1]*blocksize))
+    
+    #Dictionaries to store item and block heat over time
+    block_temperatures = {block_type: [] for block_type in BLOCK_TYPES}
+    item_temperatures = {item_type: [] for item_type in ITEM_TYPES}
+
+    for block in blocks:
+        cx_start, ry_start = block.get_topleft()
+        block_heat = thermal_equation(block.get_heat_val(), hour, flood_level, snow_level)
+        thermal_grid[ry_start:ry_start+blocksize, cx_start:cx_start+blocksize] = block_heat
+        block_temperatures[block.get_type()].append(block_heat)
+        
+        for item in block.items:
+            item_heat = thermal_equation(item.get_heat_val(), hour, flood_level, snow_level)
+            x, y = item.get_topleft()
+            size = item.get_size()
+            thermal_grid[ry_start + y:ry_start + y + size[0], cx_start + x:cx_start + x + size[1]] = item_heat
+            item_temperatures[item.get_type()].append(item_heat)
+    
+    return thermal_grid, block_temperatures, item_temperatures
+
+#Seeded preset map of a scenario
+def make_preset_map(scenario, seed=0):
+    random.seed(seed)
+    np.random.seed(seed)
+    config = get_scenario_config(scenario)
+    blocks, map_shape = make_map(config['blocksize'], config['rows'], config['cols'], config['add_forests'], config['add_parks'])
+    return blocks, map_shape, config
+
+#The renderer draws the same frames as generate_image through the day
+@pytest.mark.parametrize('scenario', ['snow', 'rain', 'normal'])
+def test_renderer_matches_generate_image(scenario):
+    blocks, map_shape, config = make_preset_map(scenario)
+    renderer = MapRenderer(copy.deepcopy(blocks), map_shape, config['blocksize'])
+
+    for hour in [0, 6, 12, 18, 23]:
+        expected = generate_image(blocks, config['blocksize'], map_shape, hour, 0, 0)
+        assert np.array_equal(renderer.generate_image(hour), expected)
+
+#The palette of every hour holds the colour each entity's day_night gives it
+def test_palette_matches_day_night():
+    blocks, map_shape, config = make_preset_map('normal')
+    renderer = MapRenderer(blocks, map_shape, config['blocksize'])
+
+    for hour in range(24):
+        time_factor = 0.1 - 0.9 * np.sin((2 * np.pi / 24) * (hour - 6))
+        for block in blocks:
+            block.day_night(time_factor)
+        expected = np.array([entity.colour for entity in renderer.entities])
+        assert np.array_equal(renderer.get_palette(hour)[:len(renderer.entities)], expected)
+
+#Weather colour changes from the schedule give the same frames as
+#recolouring every block in generate_image as the weather progresses
+@pytest.mark.parametrize('scenario', ['snow', 'rain'])
+def test_weather_matches_generate_image(scenario):
+    blocks, map_shape, config = make_preset_map(scenario)
+    renderer = MapRenderer(copy.deepcopy(blocks), map_shape, config['blocksize'])
+    total_hours = config['num_days'] * 24
+    schedule = WeatherSchedule(total_hours, config['flood'], config['stop_rain'], config['snow'])
+
+    for hour in range(total_hours):
+        flood_progress, snow_progress = schedule.get_progress(hour)
+        expected = generate_image(blocks, config['blocksize'], map_shape, hour % 24, flood_progress, snow_progress)
+        assert np.array_equal(renderer.generate_image(hour % 24), expected)
+        renderer.apply_weather(schedule.get_events(hour))
+    assert renderer.stage > 0
+
+#The cache drops the least recently used frames to stay under its byte cap,
+#skips frames larger than the cap and makes the frames it keeps read-only
+def test_frame_cache_evicts_by_bytes():
+    cache = FrameCache(max_bytes=300)
+    frames = [np.zeros(100, dtype=np.uint8) for _ in range(4)]
+    for key, frame in enumerate(frames[:3]):
+        cache.put(key, frame)
+    assert cache.get(0) is frames[0]
+
+    cache.put(3, frames[3])
+    assert len(cache) == 3 and cache.nbytes == 300
+    assert cache.get(1) is None
+    assert cache.get(0) is frames[0] and cache.get(3) is frames[3]
+
+    cache.put(4, np.zeros(301, dtype=np.uint8))
+    assert cache.get(4) is None
+    assert not frames[0].flags.writeable
+    with pytest.raises(ValueError):
+        frames[0][0] = 1
+
+#Renderers of copies of a map share cached frames until their weather differs
+def test_frame_cache_shared_by_copies():
+    blocks, map_shape, config = make_preset_map('snow')
+    cache = FrameCache()
+    first = MapRenderer(blocks, map_shape, config['blocksize'], frame_cache=cache)
+    second = MapRenderer(copy.deepcopy(blocks), map_shape, config['blocksize'], frame_cache=cache)
+
+    frame = first.generate_image(12)
+    assert second.generate_image(12) is frame
+    assert cache.hits == 1 and cache.misses == 1
+
+    second.apply_weather(WEATHER_RULES[-1:])
+    assert second.generate_image(12) is not frame
+    assert first.generate_image(12) is frame
+
+#Painting the temperatures through the labels, as run_simulation does, gives
+#the thermal map of generate_thermal_image
+@pytest.mark.parametrize('scenario', ['snow', 'rain', 'normal'])
+def test_thermal_map_matches_generate_thermal_image(scenario):
+    blocks, map_shape, config = make_preset_map(scenario)
+    raster = MapRaster(blocks, map_shape, config['blocksize'])
+
+    for hour, flood_level in [(0, 0), (9, 0.3), (15, 0.8)]:
+        expected, _, _ = generate_thermal_image(blocks, config['blocksize'], map_shape, hour, flood_level)
+        temperatures = thermal_equation_vectorized(raster.get_heat_vals(), hour, flood_level)
+        assert np.array_equal(temperatures[raster.labels], expected)